@@ -0,0 +1,86 @@
+"""Statistics shared between the plots and text summaries"""
+
+import numpy as np
+import pandas as pd
+
+from constants import FIRE_RANKINGS, RESULTS_SCORES
+
+
+def get_streaks(results: pd.Series) -> tuple[np.ndarray, np.ndarray, float, float]:
+    """
+    calculates win / loss streaks from a series of results.
+    returns the (x, y) vertices of the streak shape - triangles rather than
+    lines, where each streak starts from zero - and the best and worst streak
+    """
+    scores = pd.Series(results).map(RESULTS_SCORES).astype(float).fillna(0).to_numpy()
+    signs = np.sign(scores)
+    game_count = scores.shape[0]
+
+    # a streak starts whenever the result changes, and a draw breaks any streak
+    starts = np.ones(game_count, dtype=bool)
+    starts[1:] = (signs[1:] != signs[:-1]) | (signs[1:] == 0)
+
+    # running total within each streak
+    totals = np.cumsum(scores)
+    streak_ids = np.cumsum(starts) - 1
+    streaks = totals - (totals - scores)[starts][streak_ids]
+
+    # one vertex per game, plus an extra one at zero for the start of each streak
+    end_vertices = np.arange(game_count) + np.cumsum(starts)
+    start_vertices = end_vertices[starts] - 1
+
+    data_x = np.empty(game_count + starts.sum(), dtype=int)
+    data_x[end_vertices] = np.arange(1, game_count + 1)
+    data_x[start_vertices] = np.flatnonzero(starts)
+
+    data_y = np.zeros(game_count + starts.sum())
+    data_y[end_vertices] = streaks
+
+    # whole-game results (i.e. no wide wins / losses) give whole streaks
+    if np.all(scores % 1 == 0):
+        data_y = data_y.astype(int)
+
+    return data_x, data_y, data_y.max(), data_y.min()
+
+
+REIN_QUALITY = {"Bad": -1, "Okay": 0, "Good": 2}
+
+
+def get_rein_significance(maps: pd.Series, simulations: int = 0,
+                          max_elements: int = 2**20) -> tuple[float, float, float, float, int]:
+    """
+    compares the Reinhardt-quality of the maps played against picking maps
+    uniformly at random. returns the expected and actual mean quality, the
+    standard deviation of the expected mean, the z-score, and the number of
+    games compared (maps without a Rein ranking are left out).
+    the deviation is exact unless `simulations` is given, in which case it is
+    estimated by Monte Carlo in chunks of at most `max_elements` samples
+    """
+    all_rankings = np.array([REIN_QUALITY[r] for r in FIRE_RANKINGS.values()])
+    expected_quality = all_rankings.mean()
+
+    qualities = maps.map({map_name: REIN_QUALITY[r] for map_name, r in FIRE_RANKINGS.items()})
+    qualities = qualities.astype(float).dropna()
+    game_count = qualities.shape[0]
+    actual_quality = qualities.mean()
+    if game_count == 0:
+        return expected_quality, np.nan, np.nan, np.nan, 0
+
+    if simulations:
+        # accumulate the moments of the simulated means, one chunk at a time
+        rng = np.random.default_rng()
+        chunk_size = max(1, max_elements // game_count)
+        total, total_squares, done = 0.0, 0.0, 0
+        while done < simulations:
+            size = min(chunk_size, simulations - done)
+            scores = rng.choice(all_rankings, size=(size, game_count)).mean(axis=1)
+            total += scores.sum()
+            total_squares += np.square(scores).sum()
+            done += size
+        sigma = np.sqrt(max(total_squares / done - (total / done) ** 2, 0))
+    else:
+        # the mean of n uniform picks has a standard deviation of σ / √n
+        sigma = all_rankings.std() / np.sqrt(game_count)
+
+    z_score = (actual_quality - expected_quality) / sigma
+    return expected_quality, actual_quality, sigma, z_score, game_count
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the vote and plot hot paths, run offline against synthetic
+guild databases. See `benchmarks.run` for usage.
+"""
@@ -0,0 +1,209 @@
+"""
+Times the vote and plot hot paths against synthetic guild databases,
+reporting latency percentiles and peak (Python) memory for each.
+
+    python -m benchmarks.run --sizes 1000 100000 1000000
+
+Databases are generated once and kept in `--data-dir`. Each benchmark is
+warmed up, timed `--repeat` times, then run once more under tracemalloc for
+its peak memory. Plots are rendered in the render pool, so their peak
+excludes the worker processes.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from typing import Awaitable, Callable
+
+import numpy as np
+
+from analysis import get_rein_significance
+from benchmarks.synthetic import get_usernames, make_database
+from commands import BaseCommands
+from constants import DEFAULT_SEASON, MAPS_LIST
+from db_handler import DatabaseHandler
+from plotting import PlotCommands
+from rendering import image_cache, render_pool
+
+
+class FakeUser:
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+
+class FakeContext:
+    """stands in for a slash command's context (see `embed_handler.FakeContext`), discarding responses"""
+    def __init__(self, guild_id: int, user: FakeUser) -> None:
+        self.guild_id = guild_id
+        self.user = self.author = user
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def respond(self, *args, **kwargs):
+        pass
+
+
+async def measure(function: Callable[[], Awaitable], repeat: int) -> dict:
+    """times `repeat` calls (after one to warm up), then one more for the peak memory"""
+    await function()
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await function()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    await function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+    return {"n": repeat, "p50": p50, "p90": p90, "p99": p99, "max": max(durations), "peak": peak}
+
+
+def get_benchmarks(db_handler: DatabaseHandler, server_id: int, users: int,
+                   simulations: int) -> dict[str, Callable[[], Awaitable]]:
+    """the benchmarks to run for a database, by name"""
+    plot_commands = PlotCommands(db_handler)
+    base_commands = BaseCommands(db_handler)
+    usernames = get_usernames(users)
+    # the most active player, for the per-user plots
+    ctx = FakeContext(server_id, FakeUser(usernames[0]))
+
+    async def get_last():
+        await db_handler.get_last(server_id, count=20, username=random.choice(usernames),
+                                  map_name=random.choice(MAPS_LIST))
+
+    async def get_pandas_data_cold():
+        db_handler.frames.invalidate(server_id)
+        await db_handler.get_pandas_data(server_id)
+
+    async def get_pandas_data_user_cold():
+        db_handler.frames.invalidate(server_id)
+        await db_handler.get_pandas_data(server_id, username=ctx.user.name)
+
+    async def get_pandas_data_warm():
+        await db_handler.get_pandas_data(server_id)
+
+    def plot(command, **options):
+        async def run():
+            await command.callback(self=plot_commands, ctx=ctx, season=DEFAULT_SEASON, quality=None, **options)
+        return run
+
+    async def anti_rein():
+        await base_commands.anti_rein.callback(self=base_commands, ctx=ctx, user=None, season=DEFAULT_SEASON,
+                                               simulate=False)
+
+    async def rein_significance_simulated():
+        data = await db_handler.get_pandas_data(server_id)
+        await asyncio.to_thread(get_rein_significance, data["map"], simulations=simulations)
+
+    async def export_csv():
+        for part in await db_handler.export_csv(server_id, max_size=25 * 2**20):
+            part.close()
+
+    async def write_line():
+        await db_handler.write_line(server_id, random.choice(usernames), random.choice(MAPS_LIST), "win",
+                                    time.time())
+
+    async def vote_burst():
+        # many members voting at once, as after a match
+        await asyncio.gather(*[
+            db_handler.write_line_and_get_last(server_id, username, random.choice(MAPS_LIST), "win", time.time())
+            for username in usernames[:50]
+        ])
+
+    return {
+        "get_last": get_last,
+        "get_pandas_data (cold)": get_pandas_data_cold,
+        "get_pandas_data (cold, user)": get_pandas_data_user_cold,
+        "get_pandas_data (warm)": get_pandas_data_warm,
+        "winrate": plot(plot_commands.winrate, user=ctx.user, window_size=20),
+        "map_winrate": plot(plot_commands.map_winrate, user=None, rein_colours=False),
+        "map_play_count": plot(plot_commands.map_play_count, user=None, win_loss=True, rein_colours=False),
+        "relative_rank": plot(plot_commands.relative_rank, user=ctx.user, real_dates=False),
+        "streak": plot(plot_commands.streak, user=ctx.user, keep_aspect=True),
+        "anti_rein": anti_rein,
+        f"rein significance ({simulations} simulations)": rein_significance_simulated,
+        "export_csv": export_csv,
+        # last, as it adds rows
+        "write_line": write_line,
+        "vote burst (50 at once)": vote_burst,
+    }
+
+
+async def run_benchmarks(root_dir: str, sizes: dict[int, int], repeat: int, simulations: int,
+                         only: list[str] | None = None, batch_delay: float | None = None) -> list[dict]:
+    db_handler = DatabaseHandler(root_dir=root_dir, batch_delay=batch_delay)
+    # every plot should be rendered, not served from the cache
+    image_cache.ttl = 0
+
+    results = []
+    try:
+        # start the render workers before timing anything
+        await render_pool.render("winrate", np.full(10, 50.0))
+
+        for ratings, users in sizes.items():
+            benchmarks = get_benchmarks(db_handler, ratings, users, simulations)
+            for name, function in benchmarks.items():
+                if only and not any(pattern in name for pattern in only):
+                    continue
+
+                result = {"ratings": ratings, "benchmark": name, **await measure(function, repeat)}
+                print_result(result)
+                results.append(result)
+    finally:
+        await db_handler.close()
+        render_pool.close()
+
+    return results
+
+
+def print_result(result: dict):
+    print(f"{result['ratings']:>9} {result['benchmark']:<40} "
+          + " ".join(f"{1000 * result[key]:>9.2f}" for key in ("p50", "p90", "p99", "max"))
+          + f" {result['peak'] / 2**20:>9.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the vote and plot hot paths")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="Numbers of ratings in the synthetic databases")
+    parser.add_argument("--users", type=int, default=None,
+                        help="Number of users per database (default: one per thousand ratings, at least 20)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per benchmark")
+    parser.add_argument("--simulations", type=int, default=1_000,
+                        help="Simulations for the simulated anti-rein baseline")
+    parser.add_argument("--only", nargs="+", default=None, help="Only run benchmarks whose names contain these")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "maprater-benchmarks"),
+                        help="Where to keep the generated databases")
+    parser.add_argument("--batch-ms", type=int, default=None,
+                        help="Commit votes in batches, waiting up to this long (see `DatabaseHandler.batch_delay`)")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.data_dir, exist_ok=True)
+    root_dir = os.path.join(args.data_dir, "")
+
+    # the server id of each database is its number of ratings
+    sizes = {ratings: args.users or max(20, ratings // 1000) for ratings in args.sizes}
+    for ratings, users in sizes.items():
+        make_database(root_dir, ratings, ratings, users)
+
+    print(f"{'ratings':>9} {'benchmark':<40} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} "
+          f"{'peak MiB':>9}")
+    batch_delay = args.batch_ms / 1000 if args.batch_ms is not None else None
+    results = asyncio.run(run_benchmarks(root_dir, sizes, args.repeat, args.simulations, args.only, batch_delay))
+
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
@@ -0,0 +1,83 @@
+"""Generates synthetic guild databases, using the bot's own schema"""
+
+import asyncio
+import logging
+import os
+import sqlite3
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+
+from constants import MAP_TYPE_BY_NAME, MAPS_LIST, SEASONS
+from db_handler import DatabaseHandler
+from queries import INSERT_INTO_DATA, REBUILD_MAP_STATS, UPSERT_MAP, UPSERT_USER
+
+RESULTS = ["win", "loss", "draw", "wide-win", "wide-loss"]
+RESULT_WEIGHTS = [0.45, 0.4, 0.05, 0.05, 0.05]
+
+
+def get_usernames(users: int) -> list[str]:
+    return [f"user{i:05d}" for i in range(users)]
+
+
+async def create_schema(root_dir: str, server_id: int):
+    """creates the tables (with all migrations applied) as the bot would"""
+    db_handler = DatabaseHandler(root_dir=root_dir)
+    try:
+        await db_handler.get_line_count(server_id)
+    finally:
+        await db_handler.close()
+
+
+def make_database(root_dir: str, server_id: int, ratings: int, users: int, seed: int = 0,
+                  chunk_size: int = 100_000) -> str:
+    """
+    writes a guild database of `ratings` random votes from `users` people,
+    over all maps, unless it already exists. returns the database's path
+    """
+    path = f"{root_dir}{server_id}-v2.db"
+    if os.path.exists(path):
+        return path
+
+    logging.warning("Generating %s ratings from %s users in %s", ratings, users, path)
+    asyncio.run(create_schema(root_dir, server_id))
+
+    rng = np.random.default_rng(seed)
+    with closing(sqlite3.connect(path)) as conn:
+        cursor = conn.cursor()
+
+        user_ids = []
+        for username in get_usernames(users):
+            cursor.execute(UPSERT_USER, (username, ))
+            user_ids.append(cursor.fetchone()[0])
+
+        map_ids = []
+        for map_name in MAPS_LIST:
+            cursor.execute(UPSERT_MAP, (map_name, MAP_TYPE_BY_NAME[map_name].name.title()))
+            map_ids.append(cursor.fetchone()[0])
+
+        # some people play (and vote) far more than others
+        user_weights = 1 / np.arange(1, users + 1)
+        user_weights /= user_weights.sum()
+
+        start = datetime.fromisoformat(SEASONS[min(SEASONS)]).timestamp()
+        end = datetime.fromisoformat(SEASONS[max(SEASONS)]).timestamp()
+        times = np.sort(rng.integers(start, end, ratings))
+
+        for offset in range(0, ratings, chunk_size):
+            size = min(chunk_size, ratings - offset)
+            rows = zip(
+                rng.choice(user_ids, size, p=user_weights).tolist(),
+                rng.choice(map_ids, size).tolist(),
+                rng.choice(RESULTS, size, p=RESULT_WEIGHTS).tolist(),
+                times[offset:offset + size].tolist(),
+            )
+            cursor.executemany(INSERT_INTO_DATA, rows)
+
+        # the ratings were inserted directly, so the aggregates are made afterwards
+        for statement in REBUILD_MAP_STATS:
+            cursor.execute(statement)
+        conn.commit()
+
+    return path
@@ -1,17 +1,36 @@
+import asyncio
 import discord
 import logging
+import time
 
 from embed_handler import BUTTON_MAPS, MapButtons, PlotButtons
+from metrics import metrics, start_server
+from rendering import render_pool
 
 
 class MapRater(discord.Bot):
-    def __init__(self, db_handler, description="Overwatch Map Rating", *args, **options):
+    def __init__(self, db_handler, description="Overwatch Map Rating", *args, metrics_port: int | None = None,
+                 started_at: float | None = None, **options):
         super().__init__(description, *args, **options)
         self.db_handler = db_handler
+        # serve Prometheus metrics on this port, if given
+        self.metrics_port = metrics_port
+        self._metrics_server = None
+        # when the process started (as per `time.perf_counter`), for the startup report
+        self.started_at = started_at if started_at is not None else time.perf_counter()
+        self._warm_up_task = None
 
     async def on_ready(self):
         """Log and set presence"""
         logging.info("Bot started")
+        if self._warm_up_task is None:
+            ready = time.perf_counter() - self.started_at
+            metrics.observe("startup", "ready", ready)
+            logging.info("Ready %.2fs after starting", ready)
+
+            # kept, so the task is not garbage collected
+            self._warm_up_task = asyncio.create_task(self._warm_up())
+
         await self.change_presence(
             activity=discord.Game(name="the worst ow2 maps!")
         )
@@ -20,6 +39,38 @@ class MapRater(discord.Bot):
             self.add_view(cls(self.db_handler))
         self.add_view(PlotButtons(self.db_handler))
 
+    async def _warm_up(self):
+        """
+        imports the analytics stack (which commands otherwise import on first
+        use) and starts the render workers, now that the bot is online
+        """
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(asyncio.to_thread(_import_analytics), render_pool.warm_up())
+        except Exception:
+            logging.exception("Failed to warm up")
+            return
+
+        warm_up = time.perf_counter() - start
+        metrics.observe("startup", "warm_up", warm_up)
+        logging.info("Warmed up in %.2fs", warm_up)
+
     async def on_connect(self):
         logging.info("Syncing commands")
         await self.sync_commands()
+
+        if self.metrics_port is not None and self._metrics_server is None:
+            self._metrics_server = await start_server(self.metrics_port)
+
+    async def close(self):
+        """Close pooled database connections, render workers and the metrics server on shutdown"""
+        await self.db_handler.close()
+        render_pool.close()
+        if self._metrics_server is not None:
+            await self._metrics_server.cleanup()
+        await super().close()
+
+
+def _import_analytics():
+    """imports numpy and pandas, via `analysis`"""
+    import analysis  # noqa: F401
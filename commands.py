@@ -1,20 +1,20 @@
 """Implements basic bot commands"""
+import asyncio
 import time
 from datetime import datetime
-from io import BytesIO
 import logging
 from zoneinfo import ZoneInfo
 from statistics import NormalDist
 
 import discord
-import numpy as np
 from discord import ApplicationContext
 from discord.commands import Option, slash_command
 from discord.ext import commands
 
-from constants import FIRE_RANKINGS, DEFAULT_SEASON, MAP_TYPES, MAPS, MapType, RESULTS_EMOJI, Seasons
+from constants import DEFAULT_SEASON, MAP_TYPES, MapType, RESULTS_EMOJI, Seasons
 from embed_handler import BUTTON_MAPS, PlotButtons, UndoLast
 from db_handler import DatabaseHandler
+from metrics import span, timed
 
 
 class BaseCommands(commands.Cog):
@@ -39,9 +39,11 @@ class BaseCommands(commands.Cog):
         await ctx.respond(content=f"### Plot Commands", view=PlotButtons(self.db_handler))
 
     @slash_command(description="Get raw data")
+    @timed("data")
     async def data(self, ctx: ApplicationContext,
                    data_format: Option(str, description="Output Data Format",
-                                       required=True, choices=["sqlite", "csv"])):
+                                       required=True, choices=["sqlite", "csv"]),
+                   compress: Option(bool, description="Compress the data, for large servers", default=False)):
         """Extracts raw data from the bot"""
         logging.info("Getting Raw Data - Invoked by %s", ctx.author)
         if ctx.guild_id is None:
@@ -54,23 +56,73 @@ class BaseCommands(commands.Cog):
             await ctx.respond(content=":warning: No ratings found!", ephemeral=True)
             return
 
+        await ctx.defer(ephemeral=True)
         if data_format == "sqlite" or data_format is None:
-            path = self.db_handler.get_db_name(ctx.guild_id)
-            file = discord.File(fp=path, filename="data.db")
+            await self._send_sqlite(ctx, lines, compress)
+            return
+
+        with span("db"):
+            parts = await self.db_handler.export_csv(ctx.guild_id, ctx.guild.filesize_limit, compress=compress)
+
+        # too large for one upload: numbered parts, one per message, as the limit is on each message
+        extension = "csv.gz" if compress else "csv"
+        if len(parts) == 1:
+            filenames = [f"data.{extension}"]
         else:
-            pd_data = self.db_handler.get_pandas_data(ctx.guild_id)
-            buffer = BytesIO()
-            pd_data.to_csv(buffer, index=False)
-            buffer.seek(0)
-            file = discord.File(fp=buffer, filename="data.csv")
+            filenames = [f"data-{index + 1}.{extension}" for index in range(len(parts))]
+
+        try:
+            with span("upload"):
+                for index, (part, filename) in enumerate(zip(parts, filenames)):
+                    content = f"{lines} entries"
+                    if len(parts) > 1:
+                        content += f" (part {index + 1} of {len(parts)})"
+                    await ctx.respond(content=content, file=discord.File(fp=part, filename=filename),
+                                      ephemeral=True)
+        finally:
+            for part in parts:
+                part.close()
+
+    async def _send_sqlite(self, ctx: ApplicationContext, lines: int, compress: bool):
+        """sends a snapshot of the server's database, if it fits in an upload"""
+        with span("db"):
+            snapshot = await self.db_handler.export_sqlite(ctx.guild_id, compress=compress)
+
+        try:
+            size = snapshot.seek(0, 2)
+            snapshot.seek(0)
+            if size > ctx.guild.filesize_limit:
+                hint = "try the `csv` format" if compress else "try `compress`, or the `csv` format"
+                await ctx.respond(content=f":warning: The database is too large to upload - {hint}", ephemeral=True)
+                return
 
-        await ctx.respond(
-            content=f"{lines} entries",
-            file=file,
-            ephemeral=True
-        )
+            with span("upload"):
+                await ctx.respond(
+                    content=f"{lines} entries",
+                    file=discord.File(fp=snapshot, filename="data.db.gz" if compress else "data.db"),
+                    ephemeral=True
+                )
+        finally:
+            snapshot.close()
+
+    @slash_command(description="Recalculate this server's per-map stats")
+    async def rebuild_stats(self, ctx: ApplicationContext):
+        """
+        Rebuilds the per-map aggregates from the raw data.
+        They are kept up to date as ratings are added and removed, so this
+        should only be needed if the database was edited by hand
+        """
+        if not isinstance(ctx.user, discord.Member) or not ctx.user.guild_permissions.manage_guild:
+            await ctx.respond(content=":warning: Only server managers can do this", ephemeral=True)
+            return
+
+        logging.info("Rebuilding stats - Invoked by %s", ctx.author)
+        await ctx.defer(ephemeral=True)
+        await self.db_handler.rebuild_map_stats(ctx.guild_id)
+        await ctx.respond(content="Per-map stats rebuilt", ephemeral=True)
 
     @slash_command(description="Get the last n rows of data")
+    @timed("last")
     async def last(
         self, ctx: ApplicationContext,
         count: Option(int, description="Number of entries to return", min_value=1, default=1, max_value=100,
@@ -87,18 +139,10 @@ class BaseCommands(commands.Cog):
 
         username = str(user.name) if user is not None else None
 
-        if map_type is not None:
-            # todo: proper map type in database so we don't need to do this
-            ids, lines = await self.db_handler.get_last(ctx.guild_id, 100, username)
-        else:
-            ids, lines = await self.db_handler.get_last(ctx.guild_id, count, username)
-
-        # filter map names
-        if map_type is not None:
-            valid_maps = MAPS[MapType[map_type.upper()]]
-            ids = [i for i, l in zip(ids, lines) if l[1] in valid_maps]
-            lines = [l for l in lines if l[1] in valid_maps]
-            lines = lines[:count]
+        with span("db"):
+            ids, lines = await self.db_handler.get_last(
+                ctx.guild_id, count, username, map_type=MapType[map_type.upper()] if map_type is not None else None
+            )
 
         if len(lines) == 0:
             await ctx.respond(content=":warning: No ratings found!", ephemeral=True)
@@ -148,6 +192,7 @@ class BaseCommands(commands.Cog):
                 )
 
     @slash_command(description="Get a summary of your play today")
+    @timed("today")
     async def today(self, ctx: ApplicationContext,
                     user: Option(discord.Member, description="Get someone else's stats", required=False, default=None)):
         """Get the last few samples for this user to discord, with option to delete"""
@@ -159,29 +204,39 @@ class BaseCommands(commands.Cog):
         if user is None:
             user = ctx.user
 
-        ids, lines = await self.db_handler.get_last(ctx.guild_id, 25, user.name)
         min_time = datetime.now(tz=ZoneInfo("localtime")).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
-        lines = [l for l in lines if l[3] >= min_time]
+        with span("db"):
+            _, lines, counts = await self.db_handler.get_since(ctx.guild_id, user.name, min_time)
 
         if len(lines) == 0:
             await ctx.respond(content=":warning: No ratings found today!", ephemeral=True)
         else:
             games_summary = self._format_lines(lines, skip_username=True)
-            wins = sum([r == "win" for (_, _, r, _) in lines])
-            losses = sum([r == "loss" for (_, _, r, _) in lines])
-            games = len(lines)
+            wins = counts.get("win", 0)
+            losses = counts.get("loss", 0)
+            games = sum(counts.values())
             emoji = '🥰' if wins - losses > 5 else '🥳' if wins > losses else '🥲' if losses - wins < 2 else '😭'
             games_summary[0] = f"### Today: {emoji}\n-# Net Wins: **{wins - losses:+}** / Winrate: **{100 * wins / games:.0f}%** (played **{games}**, won **{wins}**)"
 
+            # very long sessions won't fit in one message: drop the oldest games
+            hidden = 0
+            while len("\n".join(games_summary)) >= 1950:
+                games_summary.pop()
+                hidden += 1
+            if hidden or games > len(lines):
+                games_summary[-1] += f"\n-# *...and {hidden + games - len(lines)} more*"
+
             await ctx.respond(
                 content="\n".join(games_summary),
                 ephemeral=True
             )
 
     @slash_command(description="How does your map pick-rate compare to Rein maps?")
+    @timed("anti_rein")
     async def anti_rein(self, ctx: ApplicationContext,
                         user: Option(discord.Member, description="Limit to a particular person", default=None),
-                        season: Option(Seasons, description="Overwatch Season", default=DEFAULT_SEASON)):
+                        season: Option(Seasons, description="Overwatch Season", default=DEFAULT_SEASON),
+                        simulate: Option(bool, description="Estimate the baseline by simulation", default=False)):
         """Prints the last `n` pieces of data to discord, with option to delete"""
         logging.info("Getting anti-rein - Invoked by %s", ctx.author)
         await ctx.defer(ephemeral=True)
@@ -190,9 +245,9 @@ class BaseCommands(commands.Cog):
             await ctx.respond(":warning: This bot does not support DMs")
             return
 
-        data = self.db_handler.get_pandas_data(ctx.guild_id, season.value)
-        if user is not None:
-            data = data[data.author == user.name]
+        with span("db"):
+            data = await self.db_handler.get_pandas_data(ctx.guild_id, season.value,
+                                                         username=user.name if user is not None else None)
 
         if data.shape[0] == 0:
             await ctx.respond(
@@ -201,16 +256,20 @@ class BaseCommands(commands.Cog):
             )
             raise ValueError("No data available")
 
-        desc = {"Bad": -1, "Okay": 0, "Good": 2}
-        all_rankings = [desc[r] for r in FIRE_RANKINGS.values()]
-        expected_quality = sum(all_rankings) / len(all_rankings)
-        actual_quality = sum([desc[FIRE_RANKINGS[r["map"]]] for _, r in data.iterrows()]) / data.shape[0]
-
-        # simulate it!
-        scores = np.random.choice(all_rankings, size=(50_000, data.shape[0])).mean(axis=1)
-        scores.sort()
+        # imported here, as it pulls in numpy and pandas
+        from analysis import get_rein_significance
+        with span("prep"):
+            if simulate:
+                # simulate it! (in a thread, as this can take a while for large servers)
+                expected_quality, actual_quality, sigma, z_score, game_count = await asyncio.to_thread(
+                    get_rein_significance, data["map"], simulations=50_000
+                )
+            else:
+                expected_quality, actual_quality, sigma, z_score, game_count = get_rein_significance(data["map"])
 
-        z_score = (actual_quality - expected_quality) / scores.std()
+        if game_count == 0:
+            await ctx.respond(content=":warning: None of these maps have a Rein ranking", ephemeral=True)
+            return
 
         if z_score < -2:
             opinion = "**hates**"
@@ -226,7 +285,7 @@ class BaseCommands(commands.Cog):
         await ctx.respond(
             content=f"The Overwatch team {opinion} Reinhardt! (p={2 * (1 - NormalDist().cdf(abs(z_score))):.2f})"
                     f"\n-# (assuming a uniform distribution for map selection as the baseline)"
-                    f"\n> Expected Quality: **{expected_quality:.2f}** *(n={data.shape[0]}, σ={scores.std():.3f})*"
+                    f"\n> Expected Quality: **{expected_quality:.2f}** *(n={game_count}, σ={sigma:.3f})*"
                     f"\n> Actual Quality: **{actual_quality:.2f}**"
                     f"\n> Z-score: **{z_score:.2f}**",
             ephemeral=True
@@ -19,6 +19,7 @@ MAPS = {
 }
 MAPS_LIST = [map_name for map_set in MAPS.values() for map_name in map_set]
 MAP_TYPES = [key.name.title() for key in MAPS]
+MAP_TYPE_BY_NAME = {map_name: map_type for map_type, map_set in MAPS.items() for map_name in map_set}
 
 WINLOSS_PALETTE = {"Win": "#4bc46d", "Loss": "#c9425d"}
 RESULTS_EMOJI = {"wide-win": "🏆*", "win": "🏆", "loss": "❌", "wide-loss": "❌*", "draw": "🤝"}
@@ -26,6 +27,9 @@ RESULTS_SCORES = {"wide-win": 0.5, "win": 1, "loss": -1, "wide-loss": -0.5, "dra
 RESULTS_SCORE_0_1 = {"wide-win": 0.75, "win": 1, "loss": 0, "wide-loss": 0.25, "draw": 0.5}
 RESULTS_SCORES_PRIME = {"wide-win": 1, "win": 1, "loss": -1, "wide-loss": -1, "draw": 0}
 RESULTS_SCORES_PRIME_0_1 = {"wide-win": 1, "win": 1, "loss": 0, "wide-loss": 0, "draw": 0.5}
+# (wins, losses, draws) added by each result, as kept in the `map_stats` table
+RESULTS_WIN_LOSS_DRAW = {"wide-win": (1, 0, 0), "win": (1, 0, 0), "loss": (0, 1, 0), "wide-loss": (0, 1, 0),
+                         "draw": (0, 0, 1)}
 ROLE_PALETTE = {"Tank": "tab:orange", "Damage": "tab:blue", "Support": "tab:green"}
 
 OW2_MAPS = ["Queen St", "Circuit", "Colosseo", "Midtown", "Paraiso",
@@ -51,6 +55,26 @@ class Seasons(Enum):
 
 DEFAULT_SEASON = Seasons.All
 
+
+class ExportQuality(Enum):
+    Fast = "fast"
+    Standard = "standard"
+    High = "high"
+    WebP = "webp"
+
+
+# how plots are encoded: the dpi, capped so the image is at most `max_width`
+# pixels wide, the format and its compression (zlib level 0-9 for png,
+# quality 0-100 for webp). Discord previews are well under 2000px wide.
+# Standard is what plots have always been (in effect): 100 dpi, at default compression
+EXPORT_PROFILES = {
+    ExportQuality.Fast: {"dpi": 100, "max_width": 1200, "format": "png", "compression": 1},
+    ExportQuality.Standard: {"dpi": 100, "max_width": 1800, "format": "png", "compression": 6},
+    ExportQuality.High: {"dpi": 300, "max_width": 5400, "format": "png", "compression": 9},
+    ExportQuality.WebP: {"dpi": 100, "max_width": 1800, "format": "webp", "compression": 90},
+}
+DEFAULT_EXPORT_QUALITY = ExportQuality.Standard
+
 FIRE_RANKINGS = {
     "Antarctic": "Good",
     "Busan": "Good",
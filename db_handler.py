@@ -1,92 +1,484 @@
 """Database connectivity functions"""
 
+import asyncio
 import logging
-from typing import Optional
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, closing, contextmanager
+from tempfile import SpooledTemporaryFile
+from typing import TYPE_CHECKING, Iterator, Optional
 
 import sqlite3
 import aiosqlite
-import pandas as pd
 
-from constants import SEASONS
+from constants import MAP_TYPE_BY_NAME, MAPS_LIST, MapType, RESULTS_SCORES, RESULTS_WIN_LOSS_DRAW, SEASONS
+from exports import CsvParts, snapshot_sqlite
 from queries import *
 
+if TYPE_CHECKING:
+    # pandas is slow to import, so it is only imported once first needed
+    import pandas as pd
+
+
+class ConnectionPool:
+    """
+    Keeps a single open connection per server, so that a vote does not need
+    to open (and spawn a worker thread for) a fresh connection every time.
+    Connections are closed once idle, and the number open is bounded.
+    """
+    def __init__(self, max_connections: int = 64, idle_timeout: float = 600) -> None:
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self._connections: OrderedDict[int, aiosqlite.Connection] = OrderedDict()
+        self._last_used: dict[int, float] = {}
+        self._locks: dict[int, asyncio.Lock] = {}
+
+    def _get_lock(self, server_id: int) -> asyncio.Lock:
+        if server_id not in self._locks:
+            self._locks[server_id] = asyncio.Lock()
+        return self._locks[server_id]
+
+    @asynccontextmanager
+    async def connection(self, server_id: int, path: str):
+        """
+        checks out the connection for a server, opening it if required.
+        only one caller may hold a server's connection at a time, so a
+        transaction is never interleaved with another caller's statements
+        """
+        async with self._get_lock(server_id):
+            await self._evict(keep=server_id)
+
+            conn = self._connections.get(server_id)
+            if conn is None:
+                logging.debug("Opening connection for %s", server_id)
+                conn = await aiosqlite.connect(path)
+                for pragma in CONNECTION_PRAGMAS:
+                    await conn.execute(pragma)
+                self._connections[server_id] = conn
+
+            self._connections.move_to_end(server_id)
+            try:
+                yield conn
+            except BaseException:
+                # never hand a half-finished transaction to the next caller
+                try:
+                    await conn.rollback()
+                except Exception:
+                    self._connections.pop(server_id, None)
+                    await self._close(conn)
+                raise
+            finally:
+                self._last_used[server_id] = time.monotonic()
+
+    async def _evict(self, keep: int):
+        """closes idle connections, and the least recently used if over budget"""
+        now = time.monotonic()
+        idle = [server_id for server_id in self._connections
+                if server_id != keep and not self._get_lock(server_id).locked()
+                and now - self._last_used.get(server_id, now) > self.idle_timeout]
+
+        # connections are kept in least-recently-used order
+        budget = self.max_connections - (keep not in self._connections)
+        for server_id in self._connections:
+            if len(self._connections) - len(idle) <= budget:
+                break
+            if server_id != keep and server_id not in idle and not self._get_lock(server_id).locked():
+                idle.append(server_id)
+
+        for server_id in idle:
+            # while closing the last, another caller may have taken (or evicted) this connection.
+            # check and remove it with no await in between, so no one else can pick it up
+            if self._get_lock(server_id).locked():
+                continue
+            conn = self._connections.pop(server_id, None)
+            if conn is None:
+                continue
+            self._last_used.pop(server_id, None)
+
+            logging.debug("Closing idle connection for %s", server_id)
+            await self._close(conn)
+
+    @staticmethod
+    async def _close(conn: aiosqlite.Connection):
+        try:
+            await conn.execute(WAL_CHECKPOINT)
+            await conn.close()
+        except Exception:
+            logging.exception("Failed to close connection")
+
+    async def close(self):
+        """closes every pooled connection"""
+        logging.info("Closing %s pooled connection(s)", len(self._connections))
+        while self._connections:
+            server_id, conn = self._connections.popitem(last=False)
+            async with self._get_lock(server_id):
+                await self._close(conn)
+        self._last_used.clear()
+
+
+class FrameCache:
+    """
+    Keeps histories as DataFrames, so that plots only need to read the rows
+    added since. Frames are keyed by `(server_id, *filters)`, and the least
+    recently used are dropped once they use more than `max_bytes`.
+    """
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._frames: OrderedDict[tuple, "pd.DataFrame"] = OrderedDict()
+        self._sizes: dict[tuple, int] = {}
+        self._last_seen: dict[tuple, int] = {}
+        self._generations: dict[int, int] = {}
+
+    def get(self, key: tuple) -> "pd.DataFrame | None":
+        """gets a cached frame, if present"""
+        if key in self._frames:
+            self._frames.move_to_end(key)
+        return self._frames.get(key)
+
+    def last_seen(self, key: tuple) -> int:
+        """the latest rating id in a cached frame, or 0 if there isn't one"""
+        return self._last_seen.get(key, 0)
+
+    def generation(self, server_id: int) -> int:
+        """incremented whenever a server's frames are invalidated"""
+        return self._generations.get(server_id, 0)
+
+    def put(self, key: tuple, frame: "pd.DataFrame", last_seen: int, generation: int):
+        """
+        caches a frame read up to `last_seen`, unless the server has been
+        invalidated since the read started (i.e. the frame may be stale)
+        """
+        if generation != self.generation(key[0]):
+            return
+
+        self._frames[key] = frame
+        self._frames.move_to_end(key)
+        self._sizes[key] = int(frame.memory_usage(deep=True).sum())
+        self._last_seen[key] = last_seen
+
+        while sum(self._sizes.values()) > self.max_bytes and len(self._frames) > 1:
+            evicted, _ = self._frames.popitem(last=False)
+            logging.debug("Evicting cached data for %s", evicted)
+            self._drop(evicted)
+
+    def invalidate(self, server_id: int):
+        """drops all of a server's frames, e.g. after rows are deleted"""
+        for key in [key for key in self._frames if key[0] == server_id]:
+            del self._frames[key]
+            self._drop(key)
+        self._generations[server_id] = self.generation(server_id) + 1
+
+    def _drop(self, key: tuple):
+        self._sizes.pop(key, None)
+        self._last_seen.pop(key, None)
+
+
 class DatabaseHandler:
     """A class to manage SQLite databases per-server"""
-    def __init__(self, root_dir: str = "") -> None:
+    def __init__(self, root_dir: str = "", max_connections: int = 64, idle_timeout: float = 600,
+                 max_concurrent_reads: int = 2, max_cached_bytes: int = 256 * 2**20,
+                 batch_delay: float | None = None) -> None:
         self.root_dir = root_dir
         self.tables = set()
+        # server id -> name -> row id, filled lazily as votes come in
+        self.user_ids: dict[int, dict[str, int]] = {}
+        self.map_ids: dict[int, dict[str, int]] = {}
+        # server id -> latest rating id, filled on first use by `get_data_version`
+        self.last_rating_ids: dict[int, int] = {}
+        # server id -> setting -> value, loaded on first use
+        self.settings: dict[int, dict[str, str]] = {}
+        self.pool = ConnectionPool(max_connections=max_connections, idle_timeout=idle_timeout)
+        # bounds the number of (potentially large) pandas loads run at once
+        self.read_limit = asyncio.Semaphore(max_concurrent_reads)
+        self.frames = FrameCache(max_bytes=max_cached_bytes)
+        # if set, votes are queued and committed together, at most this many seconds later (see `_queue_write`)
+        self.batch_delay = batch_delay
+        # server id -> [((username, map name, result, datetime), last count, future)], waiting to be committed
+        self.write_queues: dict[int, list[tuple[tuple, int | None, asyncio.Future]]] = {}
+        self._flush_scheduled: set[int] = set()
+        self._flush_tasks: set[asyncio.Task] = set()
 
     def get_db_name(self, server_id: int):
         return f"{self.root_dir}{server_id}-v2.db"
 
-    async def _get_user_id(self, server_id: int, username: str):
-        """Gets a user ID from a map name, inserting if not present"""
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
-            cursor = await conn.cursor()
-
-            await cursor.execute(SELECT_USERID_FROM_USERNAME, (username, ))
-            user_id = await cursor.fetchone()
+    @asynccontextmanager
+    async def _connect(self, server_id: int):
+        """checks out a pooled connection, making sure the tables exist"""
+        async with self.pool.connection(server_id, self.get_db_name(server_id)) as conn:
+            await self._ensure_tables_exist(server_id, conn)
+            yield conn
 
-            if user_id is None:
-                await cursor.execute(INSERT_INTO_USERS, (username, ))
-                await cursor.execute(SELECT_USERID_FROM_USERNAME, (username, ))
-                user_id = await cursor.fetchone()
-                await conn.commit()
-
-        return user_id[0]
-
-    async def _get_map_id(self, server_id: int, mapname: str):
+    @contextmanager
+    def _connect_sync(self, server_id: int):
+        """
+        a new, unpooled connection, for reading in worker threads (which the
+        pooled connections cannot be used from). closed when done
+        """
+        with closing(sqlite3.connect(self.get_db_name(server_id))) as conn:
+            for pragma in CONNECTION_PRAGMAS:
+                conn.execute(pragma)
+            yield conn
+
+    async def close(self):
+        """commits any queued votes, then closes all open database connections"""
+        tasks = list(self._flush_tasks)
+        for server_id in list(self.write_queues):
+            await self._flush(server_id)
+        await asyncio.gather(*tasks)
+
+        await self.pool.close()
+
+    async def _get_user_id(self, server_id: int, cursor: aiosqlite.Cursor, username: str):
+        """Gets a user ID from a username, inserting if not present"""
+        user_id = self.user_ids.setdefault(server_id, {}).get(username)
+        if user_id is None:
+            await cursor.execute(UPSERT_USER, (username, ))
+            (user_id, ) = await cursor.fetchone()
+
+        return user_id
+
+    async def _get_map_id(self, server_id: int, cursor: aiosqlite.Cursor, mapname: str):
         """Gets a map ID from a map name, inserting if not present"""
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
-            cursor = await conn.cursor()
+        map_id = self.map_ids.setdefault(server_id, {}).get(mapname)
+        if map_id is None:
+            map_type = MAP_TYPE_BY_NAME.get(mapname)
+            await cursor.execute(UPSERT_MAP, (mapname, map_type.name.title() if map_type is not None else None))
+            (map_id, ) = await cursor.fetchone()
 
-            await cursor.execute(SELECT_MAPID_FROM_MAPNAME, (mapname, ))
-            map_id = await cursor.fetchone()
+        return map_id
 
-            if map_id is None:
-                await cursor.execute(INSERT_INTO_MAPS, (mapname, ))
-                await cursor.execute(SELECT_MAPID_FROM_MAPNAME, (mapname, ))
-                map_id = await cursor.fetchone()
-                await conn.commit()
-
-        return map_id[0]
-
-    async def _ensure_tables_exist(self, server_id: int):
+    async def _ensure_tables_exist(self, server_id: int, conn: aiosqlite.Connection):
         """
         makes sure the required tables exist.
         """
         if server_id in self.tables:
             return True
 
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
-            cursor = await conn.cursor()
+        cursor = await conn.cursor()
 
-            await cursor.execute(CREATE_USER_TABLE)
-            await cursor.execute(CREATE_MAPS_TABLE)
-            await cursor.execute(CREATE_DATA_TABLE)
+        await cursor.execute(CREATE_USER_TABLE)
+        await cursor.execute(CREATE_MAPS_TABLE)
+        await cursor.execute(CREATE_DATA_TABLE)
+        await conn.commit()
 
-            await cursor.close()
-            await conn.commit()
+        await self._migrate(server_id, conn, cursor)
+
+        await cursor.close()
+        await conn.commit()
 
         self.tables.add(server_id)
 
+    @staticmethod
+    async def _migrate(server_id: int, conn: aiosqlite.Connection, cursor: aiosqlite.Cursor):
+        """applies any schema migrations the database has not yet seen"""
+        await cursor.execute(SELECT_SCHEMA_VERSION)
+        (version, ) = await cursor.fetchone()
+
+        for new_version, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+            logging.info("Migrating %s to schema version %s", server_id, new_version)
+            # each migration is applied (and recorded) atomically
+            await cursor.execute("BEGIN")
+            for statement in statements:
+                if isinstance(statement, tuple):
+                    await cursor.executemany(*statement)
+                else:
+                    await cursor.execute(statement)
+            await cursor.execute(SET_SCHEMA_VERSION(new_version))
+            await conn.commit()
+
+    async def _insert_line(self, server_id: int, cursor: aiosqlite.Cursor, username: str, mapname: str,
+                           result: str, datetime: float):
+        """inserts a map review, returning the ids to record once committed"""
+        map_id = await self._get_map_id(server_id, cursor, mapname)
+        user_id = await self._get_user_id(server_id, cursor, username)
+        await cursor.execute(INSERT_INTO_DATA, (user_id, map_id, result, int(datetime)))
+        rating_id = cursor.lastrowid
+
+        await cursor.execute(UPSERT_MAP_STATS, (user_id, map_id, *RESULTS_WIN_LOSS_DRAW[result], int(datetime)))
+        return user_id, map_id, rating_id
+
+    def _record_write(self, server_id: int, username: str, user_id: int, mapname: str, map_id: int,
+                      rating_id: int):
+        """only cache ids once they are committed, in case of a rollback"""
+        self.user_ids[server_id][username] = user_id
+        self.map_ids[server_id][mapname] = map_id
+        if server_id in self.last_rating_ids:
+            self.last_rating_ids[server_id] = max(self.last_rating_ids[server_id], rating_id)
+
     async def write_line(self, server_id: int, username: str, mapname: str,
                          result: str, datetime: float):
         """writes a map review to the database"""
-        await self._ensure_tables_exist(server_id)
-        map_id = await self._get_map_id(server_id, mapname)
-        user_id = await self._get_user_id(server_id, username)
+        if self.batch_delay is not None:
+            await self._queue_write(server_id, username, mapname, result, datetime)
+        else:
+            await self._write_line_now(server_id, username, mapname, result, datetime)
+
+    async def _write_line_now(self, server_id: int, username: str, mapname: str, result: str, datetime: float):
+        """writes a map review in its own transaction"""
+        async with self._connect(server_id) as conn:
+            cursor = await conn.cursor()
+
+            user_id, map_id, rating_id = await self._insert_line(server_id, cursor, username, mapname, result,
+                                                                 datetime)
 
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
+            await cursor.close()
+            await conn.commit()
+
+        self._record_write(server_id, username, user_id, mapname, map_id, rating_id)
+
+    async def write_line_and_get_last(self, server_id: int, username: str, mapname: str,
+                                      result: str, datetime: float, count: int = 5) -> tuple[list, list]:
+        """
+        writes a map review to the database, then gets the user's last
+        `count` lines in the same transaction (as per `get_last`)
+        """
+        if self.batch_delay is not None:
+            return await self._queue_write(server_id, username, mapname, result, datetime, count)
+        return await self._write_line_and_get_last_now(server_id, username, mapname, result, datetime, count)
+
+    async def _write_line_and_get_last_now(self, server_id: int, username: str, mapname: str, result: str,
+                                           datetime: float, count: int) -> tuple[list, list]:
+        """writes a map review in its own transaction, and gets the user's last lines"""
+        async with self._connect(server_id) as conn:
             cursor = await conn.cursor()
 
-            await cursor.execute(INSERT_INTO_DATA, (user_id, map_id, result, int(datetime)))
+            user_id, map_id, rating_id = await self._insert_line(server_id, cursor, username, mapname, result,
+                                                                 datetime)
+            ids, lines = await self._select_last(cursor, count, username)
 
             await cursor.close()
             await conn.commit()
 
+        self._record_write(server_id, username, user_id, mapname, map_id, rating_id)
+        return ids, lines
+
+    async def _queue_write(self, server_id: int, username: str, mapname: str, result: str, datetime: float,
+                           count: int | None = None):
+        """
+        queues a map review to be committed along with any others made within
+        `batch_delay`, returning once it has been committed - with the user's
+        last `count` lines, if given (as per `write_line_and_get_last`)
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.write_queues.setdefault(server_id, []).append(((username, mapname, result, datetime), count, future))
+
+        if server_id not in self._flush_scheduled:
+            self._flush_scheduled.add(server_id)
+            task = asyncio.create_task(self._flush_later(server_id))
+            # kept, so the task is not garbage collected (and can be waited for on close)
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+        return await future
+
+    async def _flush_later(self, server_id: int):
+        await asyncio.sleep(self.batch_delay)
+        await self._flush(server_id)
+
+    async def _flush(self, server_id: int):
+        """commits a server's queued reviews in one transaction, then lets their writers know"""
+        self._flush_scheduled.discard(server_id)
+        pending = self.write_queues.pop(server_id, [])
+        if not pending:
+            return
+
+        logging.debug("Writing %s queued line(s) for %s", len(pending), server_id)
+        try:
+            async with self._connect(server_id) as conn:
+                cursor = await conn.cursor()
+
+                user_ids, map_ids = {}, {}
+                for (username, mapname, _, _), _, _ in pending:
+                    if username not in user_ids:
+                        user_ids[username] = await self._get_user_id(server_id, cursor, username)
+                    if mapname not in map_ids:
+                        map_ids[mapname] = await self._get_map_id(server_id, cursor, mapname)
+
+                rows = [(user_ids[username], map_ids[mapname], result, int(datetime))
+                        for (username, mapname, result, datetime), _, _ in pending]
+                # one at a time, to know each row's id
+                rating_ids = []
+                for row in rows:
+                    await cursor.execute(INSERT_INTO_DATA, row)
+                    rating_ids.append(cursor.lastrowid)
+
+                await cursor.executemany(UPSERT_MAP_STATS, [
+                    (user_id, map_id, *RESULTS_WIN_LOSS_DRAW[result], datetime)
+                    for user_id, map_id, result, datetime in rows
+                ])
+
+                # as of each review, so a vote's results never include a later one from the same batch
+                results = [
+                    await self._select_last(cursor, count, username, up_to=rating_id) if count is not None else None
+                    for ((username, _, _, _), count, _), rating_id in zip(pending, rating_ids)
+                ]
+
+                await cursor.close()
+                await conn.commit()
+        except Exception:
+            # nothing was committed - write each on its own, so only bad reviews fail
+            logging.exception("Failed to write %s queued line(s) for %s, retrying one by one", len(pending), server_id)
+            for line, count, future in pending:
+                try:
+                    if count is not None:
+                        result = await self._write_line_and_get_last_now(server_id, *line, count)
+                    else:
+                        result = await self._write_line_now(server_id, *line)
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            return
+
+        for ((username, mapname, _, _), _, future), result in zip(pending, results):
+            self._record_write(server_id, username, user_ids[username], mapname, map_ids[mapname], rating_ids[-1])
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    async def _select_last(cursor: aiosqlite.Cursor, count: int, username: Optional[str] = None,
+                           map_name: Optional[str] = None, map_type: Optional[MapType] = None,
+                           up_to: Optional[int] = None) -> tuple[list, list]:
+        """
+        runs the query behind `get_last` on an open cursor.
+        `up_to` (a rating id) is only supported when filtering by username alone
+        """
+        if up_to is not None and (username is None or map_name is not None or map_type is not None):
+            raise NotImplementedError()
+
+        # WARN: This does risk SQL injection! However, given the value is a
+        #       bounded int, this should not pose much concern
+        if username is not None:
+            if map_name is not None:
+                query = SELECT_LAST_N_USERNAME_MAP(count)
+                await cursor.execute(query, (username, map_name,))
+            elif map_type is not None:
+                query = SELECT_LAST_N_USERNAME_TYPE(count)
+                await cursor.execute(query, (username, map_type.name.title(),))
+            elif up_to is not None:
+                query = SELECT_LAST_N_USERNAME(count, up_to=True)
+                await cursor.execute(query, (username, up_to))
+            else:
+                query = SELECT_LAST_N_USERNAME(count)
+                await cursor.execute(query, (username,))
+        elif map_name is not None:
+            raise NotImplementedError()
+        elif map_type is not None:
+            query = SELECT_LAST_N_TYPE(count)
+            await cursor.execute(query, (map_type.name.title(),))
+        else:
+            query = SELECT_LAST_N(count)
+            await cursor.execute(query)
+
+        result = await cursor.fetchall()
+
+        # split into rating id and other information
+        return [line[0] for line in result], [line[1:] for line in result]
+
     async def get_last(self, server_id: int, count: int = 1, username: Optional[str] = None,
-                       map_name: Optional[str] = None) -> tuple[list, list]:
+                       map_name: Optional[str] = None, map_type: Optional[MapType] = None) -> tuple[list, list]:
         """
         gets the last line of data from the file, if present
         """
@@ -96,31 +488,31 @@ class DatabaseHandler:
         if count not in list(range(101)):
             return [], []
 
-        await self._ensure_tables_exist(server_id)
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
+        async with self._connect(server_id) as conn:
             cursor = await conn.cursor()
+            ids, lines = await self._select_last(cursor, count, username, map_name, map_type)
+            await cursor.close()
 
-            # WARN: This does risk SQL injection! However, given the value is a
-            #       bounded int, this should not pose much concern
-            if username is not None:
-                if map_name is not None:
-                    query = SELECT_LAST_N_USERNAME_MAP(count)
-                    await cursor.execute(query, (username, map_name,))
-                else:
-                    query = SELECT_LAST_N_USERNAME(count)
-                    await cursor.execute(query, (username,))
-            elif map_name is not None:
-                raise NotImplementedError()
-            else:
-                query = SELECT_LAST_N(count)
-                await cursor.execute(query)
+        return ids, lines
 
+    async def get_since(self, server_id: int, username: str, since: float,
+                        count: int = 100) -> tuple[list, list, dict[str, int]]:
+        """
+        gets a user's ratings since a given time (as per `get_last`, up to
+        `count` lines), and the number of each result over that period
+        """
+        async with self._connect(server_id) as conn:
+            cursor = await conn.cursor()
+
+            await cursor.execute(SELECT_SINCE_USERNAME(count), (username, int(since)))
             result = await cursor.fetchall()
 
+            await cursor.execute(SELECT_RESULT_COUNTS_SINCE_USERNAME, (username, int(since)))
+            counts = dict(await cursor.fetchall())
+
             await cursor.close()
 
-        # split into rating id and other information
-        return [line[0] for line in result], [line[1:] for line in result]
+        return [line[0] for line in result], [line[1:] for line in result], counts
 
     async def delete_ids(self, server_id: int, ids: list[int]):
         """
@@ -131,18 +523,50 @@ class DatabaseHandler:
         if len(ids) > 20:
             return
 
-        await self._ensure_tables_exist(server_id)
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
+        async with self._connect(server_id) as conn:
             cursor = await conn.cursor()
 
             await cursor.execute(DELETE_N_IDS(len(ids)), ids)
+            deleted = await cursor.fetchall()
+
+            # take the deleted ratings off the aggregates
+            await cursor.executemany(UPDATE_MAP_STATS_DELETED, [
+                (*RESULTS_WIN_LOSS_DRAW[result], author_id, map_id) for author_id, map_id, result in deleted
+            ])
+            await cursor.execute(DELETE_EMPTY_MAP_STATS)
+
+            await cursor.close()
+            await conn.commit()
+
+        self.frames.invalidate(server_id)
+
+    async def get_map_stats(self, server_id: int, username: Optional[str] = None) -> "pd.DataFrame":
+        """
+        gets the number of wins, losses and draws on each map (that has been
+        played), indexed by map name. wide results count as wins and losses
+        """
+        async with self._connect(server_id) as conn:
+            cursor = await conn.cursor()
+            await cursor.execute(SELECT_MAP_STATS(username is not None), (username, ) if username is not None else ())
+            rows = await cursor.fetchall()
+            await cursor.close()
+
+        import pandas as pd
+        return pd.DataFrame(rows, columns=["map", "wins", "losses", "draws"]).set_index("map")
+
+    async def rebuild_map_stats(self, server_id: int):
+        """recalculates the per-map aggregates from every rating"""
+        logging.info("Rebuilding map stats for %s", server_id)
+        async with self._connect(server_id) as conn:
+            cursor = await conn.cursor()
+            for statement in REBUILD_MAP_STATS:
+                await cursor.execute(statement)
             await cursor.close()
             await conn.commit()
 
     async def get_line_count(self, server_id: int):
         """gets the number of (data) lines in the file"""
-        await self._ensure_tables_exist(server_id)
-        async with aiosqlite.connect(self.get_db_name(server_id)) as conn:
+        async with self._connect(server_id) as conn:
             cursor = await conn.cursor()
 
             await cursor.execute("select count(rating_id) from ow2")
@@ -153,18 +577,173 @@ class DatabaseHandler:
 
         return count
 
-    def get_pandas_data(self, server_id: int, season: int | None = None):
+    async def get_data_version(self, server_id: int) -> tuple[int, int]:
         """
-        reads the csv file into a Pandas df
-        note that this function is *not* async
+        identifies the current state of a server's data: this changes
+        whenever a rating is added or deleted
         """
-        logging.info("Getting data as Pandas")
+        if server_id not in self.last_rating_ids:
+            async with self._connect(server_id) as conn:
+                cursor = await conn.cursor()
+                await cursor.execute(SELECT_MAX_RATING_ID)
+                (rating_id, ) = await cursor.fetchone()
+                await cursor.close()
+            self.last_rating_ids[server_id] = rating_id or 0
+
+        return self.last_rating_ids[server_id], self.frames.generation(server_id)
+
+    async def get_setting(self, server_id: int, key: str, default: Optional[str] = None) -> Optional[str]:
+        """gets a per-server setting"""
+        if server_id not in self.settings:
+            async with self._connect(server_id) as conn:
+                cursor = await conn.cursor()
+                await cursor.execute(SELECT_SETTINGS)
+                self.settings[server_id] = dict(await cursor.fetchall())
+                await cursor.close()
+
+        return self.settings[server_id].get(key, default)
+
+    async def set_setting(self, server_id: int, key: str, value: str):
+        """sets a per-server setting"""
+        async with self._connect(server_id) as conn:
+            cursor = await conn.cursor()
+            await cursor.execute(UPSERT_SETTING, (key, value))
+            await cursor.close()
+            await conn.commit()
+
+        if server_id in self.settings:
+            self.settings[server_id][key] = value
 
-        with sqlite3.connect(self.get_db_name(server_id)) as conn:
-            if season and (season + 1 in SEASONS):
-                data = pd.read_sql_query(SELECT_ALL_PANDAS_SEASON, conn, params=[SEASONS[season], SEASONS[season + 1]])
+    async def get_pandas_data(self, server_id: int, season: int | None = None, username: str | None = None,
+                              map_name: str | None = None, map_type: MapType | None = None):
+        """
+        reads the server's data into a Pandas df, indexed by rating id.
+        user and map filters are applied in the query, and each filtered
+        history is cached, so only new rows are read from the database - in
+        a worker thread, so that large servers do not block the event loop
+        """
+        key = (server_id, username, map_name, map_type)
+        async with self.read_limit:
+            generation = self.frames.generation(server_id)
+            cached = self.frames.get(key)
+            last_seen = self.frames.last_seen(key)
+
+            new_data = await asyncio.to_thread(self._read_pandas_data, server_id, last_seen, username, map_name,
+                                               map_type)
+            if cached is None:
+                data = new_data
+            elif new_data.shape[0] == 0:
+                data = cached
             else:
-                data = pd.read_sql_query(SELECT_ALL_PANDAS, conn)
+                data = self._concat_frames(cached, new_data)
+
+            if not new_data.empty:
+                last_seen = int(new_data.index[-1])
+            self.frames.put(key, data, last_seen, generation)
 
-        data["time"] = pd.to_datetime(data["time"])
+        if season and (season + 1 in SEASONS):
+            return data[(data["time"] >= SEASONS[season]) & (data["time"] < SEASONS[season + 1])].copy()
+        # callers are free to modify what they are given
+        return data.copy()
+
+    def _read_pandas_data(self, server_id: int, after: int = 0, username: str | None = None,
+                          map_name: str | None = None, map_type: MapType | None = None):
+        """
+        reads the server's data into a Pandas df, for ratings after `after`
+        note that this function is *not* async
+        """
+        import pandas as pd
+        logging.info("Getting data as Pandas")
+
+        params = [after]
+        if username is not None:
+            params.append(username)
+        if map_name is not None:
+            params.append(map_name)
+        if map_type is not None:
+            params.append(map_type.name.title())
+        query = SELECT_PANDAS_SINCE(username is not None, map_name is not None, map_type is not None)
+
+        with self._connect_sync(server_id) as conn:
+            data = pd.read_sql_query(query, conn, params=params, index_col="rating_id")
+
+        data["time"] = pd.to_datetime(data["time"], unit="s")
+        data["author"] = self._as_categorical(data["author"])
+        data["map"] = self._as_categorical(data["map"], MAPS_LIST)
+        data["winloss"] = self._as_categorical(data["winloss"], list(RESULTS_SCORES))
         return data
+
+    async def export_csv(self, server_id: int, max_size: int, compress: bool = False,
+                         page_size: int = 10_000) -> list[SpooledTemporaryFile]:
+        """
+        exports the server's data as CSV files of at most `max_size` bytes,
+        optionally gzipped. the data is read a page at a time, in a worker
+        thread, so that large servers are never held in memory at once
+        """
+        async with self.read_limit:
+            return await asyncio.to_thread(self._export_csv, server_id, max_size, compress, page_size)
+
+    def _export_csv(self, server_id: int, max_size: int, compress: bool, page_size: int):
+        """note that this function is *not* async"""
+        logging.info("Exporting data as CSV")
+        parts = CsvParts(max_size, compress)
+        try:
+            for rows in self._read_pages(server_id, page_size):
+                parts.write_rows(rows)
+        except Exception:
+            for part in parts.parts:
+                part.close()
+            raise
+        return parts.close()
+
+    async def export_sqlite(self, server_id: int, compress: bool = False) -> SpooledTemporaryFile:
+        """
+        a consistent copy of the server's database (see `snapshot_sqlite`),
+        made in a worker thread. votes can still be written while it is made
+        """
+        async with self.read_limit:
+            return await asyncio.to_thread(self._export_sqlite, server_id, compress)
+
+    def _export_sqlite(self, server_id: int, compress: bool):
+        """note that this function is *not* async"""
+        logging.info("Exporting data as SQLite")
+        with self._connect_sync(server_id) as conn:
+            return snapshot_sqlite(conn, compress)
+
+    def _read_pages(self, server_id: int, page_size: int) -> Iterator[list[tuple]]:
+        """
+        reads all of the ratings, `page_size` at a time (without their ids),
+        paging by rating id rather than by offset so each page is as quick as the first
+        """
+        with self._connect_sync(server_id) as conn:
+            last_id = 0
+            while True:
+                rows = conn.execute(SELECT_EXPORT_PAGE, (last_id, page_size)).fetchall()
+                if not rows:
+                    return
+
+                last_id = rows[-1][0]
+                yield [row[1:] for row in rows]
+
+    @staticmethod
+    def _as_categorical(column: "pd.Series", known: list[str] | None = None) -> "pd.Series":
+        """converts a string column to a categorical, with any known values first"""
+        import pandas as pd
+        known = known or []
+        extra = sorted(set(column.unique()) - set(known))
+        return column.astype(pd.CategoricalDtype(known + extra))
+
+    @staticmethod
+    def _concat_frames(first: "pd.DataFrame", second: "pd.DataFrame") -> "pd.DataFrame":
+        """concatenates two history frames, keeping the categorical columns categorical"""
+        import pandas as pd
+        second = second.copy(deep=False)
+        for column in ("author", "map", "winloss"):
+            categories = first[column].cat.categories
+            new_categories = second[column].cat.categories.difference(categories)
+            if len(new_categories):
+                categories = categories.append(new_categories)
+                first = first.assign(**{column: first[column].cat.set_categories(categories)})
+            second[column] = second[column].cat.set_categories(categories)
+
+        return pd.concat([first, second])
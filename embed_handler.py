@@ -9,6 +9,7 @@ from discord.interactions import Interaction
 
 from db_handler import DatabaseHandler
 from constants import DEFAULT_SEASON, MAPS, MapType, RESULTS_EMOJI
+from metrics import command, span
 from plotting import PlotCommands
 
 
@@ -27,16 +28,19 @@ class MapButtons(discord.ui.View):
 
     async def _callback(self, map_name, interaction: Interaction):
         logging.info("map callback - %s by %s", map_name, interaction.user)
-        _, past_results = await self.db_handler.get_last(server_id=interaction.guild_id, count=20,
-                                                         username=interaction.user.name, map_name=map_name)
-        past_results_emoji = [RESULTS_EMOJI[result] for _, _, result, _ in past_results]
-        text = f"**{map_name}**\n-# Past Results: {''.join(past_results_emoji)}\n"
-
-        await interaction.response.send_message(
-            content=text,
-            view=VotingButtons(map_name, self.db_handler),
-            ephemeral=True
-        )
+        with command("map_button", interaction.guild_id):
+            with span("db"):
+                _, past_results = await self.db_handler.get_last(server_id=interaction.guild_id, count=20,
+                                                                 username=interaction.user.name, map_name=map_name)
+            past_results_emoji = [RESULTS_EMOJI[result] for _, _, result, _ in past_results]
+            text = f"**{map_name}**\n-# Past Results: {''.join(past_results_emoji)}\n"
+
+            with span("upload"):
+                await interaction.response.send_message(
+                    content=text,
+                    view=VotingButtons(map_name, self.db_handler),
+                    ephemeral=True
+                )
 
     def make_buttons(self):
         if self.MAP_TYPES is None:
@@ -102,12 +106,18 @@ class VotingButtons(discord.ui.View):
         assert interaction.guild_id is not None
         logging.info("%s voted: %s on %s", interaction.user.name, result, self.map)
 
-        await self.db_handler.write_line(server_id=interaction.guild_id, username=interaction.user.name, mapname=self.map, result=result, datetime=time.time())
-        _, recent_results = await self.db_handler.get_last(server_id=interaction.guild_id, count=5, username=interaction.user.name)
-        recent_results_emoji = [RESULTS_EMOJI[result] for _, _, result, _ in recent_results]
+        with command("vote", interaction.guild_id):
+            with span("db"):
+                _, recent_results = await self.db_handler.write_line_and_get_last(
+                    server_id=interaction.guild_id, username=interaction.user.name, mapname=self.map, result=result,
+                    datetime=time.time(), count=5
+                )
+            recent_results_emoji = [RESULTS_EMOJI[result] for _, _, result, _ in recent_results]
 
-        await interaction.response.edit_message(content=f"**{result.title()}** on **{self.map}**\n"
-                                                        f"-# Recent Games: {''.join(recent_results_emoji)}", view=None)
+            with span("upload"):
+                await interaction.response.edit_message(content=f"**{result.title()}** on **{self.map}**\n"
+                                                                f"-# Recent Games: {''.join(recent_results_emoji)}",
+                                                        view=None)
 
 
 class FakeContext:
@@ -132,7 +142,8 @@ class PlotButtons(discord.ui.View):
             ctx=FakeContext(interaction),
             user=interaction.user,
             rein_colours=False,
-            season=DEFAULT_SEASON
+            season=DEFAULT_SEASON,
+            quality=None
         )
 
     @discord.ui.button(label="Per-Map Play Count", custom_id="pmpc", style=ButtonStyle.blurple)
@@ -143,7 +154,8 @@ class PlotButtons(discord.ui.View):
             user=interaction.user,
             win_loss=False,
             rein_colours=False,
-            season=DEFAULT_SEASON
+            season=DEFAULT_SEASON,
+            quality=None
         )
 
     @discord.ui.button(label="Rolling Winrate", custom_id="rw", style=ButtonStyle.green)
@@ -153,7 +165,8 @@ class PlotButtons(discord.ui.View):
             ctx=FakeContext(interaction),
             user=interaction.user,
             window_size=20,
-            season=DEFAULT_SEASON
+            season=DEFAULT_SEASON,
+            quality=None
         )
 
     @discord.ui.button(label="Relative Rank", custom_id="rr", style=ButtonStyle.green)
@@ -163,7 +176,8 @@ class PlotButtons(discord.ui.View):
             ctx=FakeContext(interaction),
             user=interaction.user,
             real_dates=False,
-            season=DEFAULT_SEASON
+            season=DEFAULT_SEASON,
+            quality=None
         )
 
     @discord.ui.button(label="Streaks", custom_id="s", style=ButtonStyle.red)
@@ -173,7 +187,8 @@ class PlotButtons(discord.ui.View):
             ctx=FakeContext(interaction),
             user=interaction.user,
             keep_aspect=True,
-            season=DEFAULT_SEASON
+            season=DEFAULT_SEASON,
+            quality=None
         )
 
 
@@ -0,0 +1,136 @@
+"""
+Writes out a server's data for /data.
+Exports are written into spooled temporary files - CSVs a chunk of rows at
+a time - so that exporting a large server never holds its whole history in
+memory. These functions are not async - they are run in worker threads (see
+`DatabaseHandler.export_csv` and `DatabaseHandler.export_sqlite`).
+"""
+
+import csv
+import gzip
+import io
+import os
+import shutil
+import sqlite3
+import zlib
+from contextlib import closing
+from tempfile import SpooledTemporaryFile, TemporaryDirectory
+from typing import Iterable
+
+CSV_COLUMNS = ["author", "map", "winloss", "time"]
+# exports are kept in memory up to this size, then moved to disk
+SPOOL_SIZE = 2**20
+# space to leave at the end of a gzipped part, for its trailer
+GZIP_TRAILER = 16
+
+
+class CsvParts:
+    """
+    A CSV file, split into parts of at most `max_size` bytes (each with the
+    header), optionally gzipped. Parts are only ever split between rows
+    """
+    def __init__(self, max_size: int, compress: bool = False) -> None:
+        self.max_size = max_size
+        self.compress = compress
+        self.parts: list[SpooledTemporaryFile] = []
+
+        self._file: SpooledTemporaryFile | None = None
+        self._compressor = None
+        self._size = 0
+        self._rows = 0
+
+    def write_rows(self, rows: list[tuple]):
+        """appends rows to the current part, starting new parts as they fill up"""
+        if not rows:
+            return
+        if self._file is None:
+            self._new_part()
+
+        data, compressor = self._encode(rows)
+        reserved = GZIP_TRAILER if self.compress else 0
+        if self._size + len(data) + reserved <= self.max_size:
+            self._file.write(data)
+            self._compressor = compressor
+            self._size += len(data)
+            self._rows += len(rows)
+        elif len(rows) > 1:
+            # fill up the part with as many of the rows as will fit
+            half = len(rows) // 2
+            self.write_rows(rows[:half])
+            self.write_rows(rows[half:])
+        elif self._rows > 0:
+            self._new_part()
+            self.write_rows(rows)
+        else:
+            raise ValueError("A single row is larger than the size limit")
+
+    def close(self) -> list[SpooledTemporaryFile]:
+        """finishes the last part, returning every part (rewound)"""
+        if self._file is None:
+            self._new_part()
+        self._end_part()
+
+        for part in self.parts:
+            part.seek(0)
+        return self.parts
+
+    def _new_part(self):
+        if self._file is not None:
+            self._end_part()
+
+        self._file = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.parts.append(self._file)
+        # the gzip header comes with the first compressed data
+        self._compressor = zlib.compressobj(wbits=31) if self.compress else None
+        self._size = self._rows = 0
+
+        header, self._compressor = self._encode([CSV_COLUMNS])
+        self._file.write(header)
+        self._size = len(header)
+
+    def _end_part(self):
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush())
+
+    def _encode(self, rows: Iterable) -> tuple[bytes, object]:
+        """
+        encodes rows as CSV (as `DataFrame.to_csv` would), compressing them if needed.
+        returns the data, and the compressor to carry on with if the data is kept
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        data = buffer.getvalue().encode()
+        if self._compressor is None:
+            return data, None
+
+        # flushed, so that the part's size is known exactly
+        compressor = self._compressor.copy()
+        return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH), compressor
+
+
+def snapshot_sqlite(conn: sqlite3.Connection, compress: bool = False) -> SpooledTemporaryFile:
+    """
+    copies a database with SQLite's backup API, which (unlike copying the
+    file) includes anything still in the WAL and cannot see a half-written
+    transaction. with `compress`, the copy is vacuumed and gzipped
+    """
+    output = SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    with TemporaryDirectory() as directory:
+        path = os.path.join(directory, "data.db")
+        with closing(sqlite3.connect(path)) as copy:
+            # in one step, as a stepped backup restarts whenever a vote is written
+            conn.backup(copy)
+            # a single, self-contained file
+            copy.execute("PRAGMA journal_mode = DELETE")
+            if compress:
+                copy.execute("VACUUM")
+
+        with open(path, "rb") as file:
+            if compress:
+                with gzip.GzipFile(fileobj=output, mode="wb") as compressed:
+                    shutil.copyfileobj(file, compressed)
+            else:
+                shutil.copyfileobj(file, output)
+
+    output.seek(0)
+    return output
@@ -0,0 +1,290 @@
+"""
+Draws the plots.
+These functions run in the render pool's worker processes (see `rendering`),
+so they only take compact, picklable data. Each returns a figure, which is
+then encoded with `export_figure`.
+
+Figures are not made through pyplot: each chart type has a template figure,
+with its styling and static parts drawn once per worker. Each plot only adds
+the data, which is removed again the next time the template is used.
+"""
+
+import colorsys
+import logging
+from io import BytesIO
+from typing import Callable
+
+import matplotlib as mpl
+import matplotlib.dates as mdates
+import matplotlib.style as mstyle
+import numpy as np
+from matplotlib.artist import setp
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgb
+from matplotlib.figure import Figure
+from matplotlib.ticker import MaxNLocator
+
+from constants import SEASONS
+
+mpl.use("agg")  # force non-interactive backend
+# styling is applied once, as workers only ever draw these plots
+mstyle.use('dark_background')
+mpl.rcParams['axes.xmargin'] = 0 # tight x axes
+# hide top/right spines
+mpl.rcParams['axes.spines.right'] = False
+mpl.rcParams['axes.spines.top'] = False
+
+
+# the dpi figures are laid out at (see `export_figure`)
+LAYOUT_DPI = 500
+
+
+class Template:
+    """A figure with the static parts of a chart already drawn"""
+    def __init__(self, width: float, setup: Callable[[Axes], None] | None = None) -> None:
+        self.fig = Figure(figsize=(width, 4))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self._subplot_params = vars(self.fig.subplotpars).copy()
+
+        if setup is not None:
+            setup(self.ax)
+        self._static = set(self.ax.get_children())
+
+    def reset(self):
+        """removes everything drawn since the template was made"""
+        ax = self.ax
+        for container in list(ax.containers):
+            container.remove()
+        for artist in ax.get_children():
+            if artist not in self._static:
+                artist.remove()
+
+        # undo any per-plot layout, so the figure is as if new
+        ax.set_aspect("auto", adjustable="box")
+        ax.set_prop_cycle(None)  # start from the first colour again
+        ax.relim()
+        ax.autoscale()
+        self.fig.subplots_adjust(**self._subplot_params)
+
+
+_templates: dict[tuple, Template] = {}
+
+
+def get_template(chart: str, width: float = 12, setup: Callable[[Axes], None] | None = None) -> Template:
+    """gets the (reset) template for a chart, making it on first use"""
+    template = _templates.get((chart, width))
+    if template is None:
+        template = _templates[(chart, width)] = Template(width, setup)
+    else:
+        template.reset()
+    return template
+
+
+def _setup_winrate(ax: Axes):
+    # benchmark: 50% winrate
+    ax.axhline(50, color="white", linewidth=1)
+
+    ax.set_ylabel("Winrate (%)")
+    ax.get_xaxis().set_visible(False)
+    ax.spines[["bottom", "top", "right"]].set_visible(False)
+
+
+def winrate(winrate: np.ndarray) -> Figure:
+    """rolling winrate history"""
+    logging.info("making plot")
+    template = get_template("winrate", setup=_setup_winrate)
+    ax = template.ax
+
+    # your current winrate
+    ax.plot(winrate, color="white", linewidth=3)
+
+    # fills for that winrate
+    ax.fill_between(range(len(winrate)), winrate, 50, where=winrate <= 50, color="tab:red", interpolate=True, alpha=0.3)
+    ax.fill_between(range(len(winrate)), winrate, 50, where=winrate >= 50, color="tab:green", interpolate=True, alpha=0.3)
+
+    ax.set_ylim(0, 100)
+    ax.set_xlim(0, len(winrate) - 1)
+
+    return template.fig
+
+
+def _setup_map_winrate(ax: Axes):
+    ax.axhline(50, color="white", linewidth=1, zorder=-1)
+    ax.set_ylabel("Winrate (%)")
+    ax.set_xlabel("Map")
+
+
+def _setup_map_net_wins(ax: Axes):
+    ax.axhline(0, color="white", linewidth=1, zorder=2)
+    ax.set_ylabel("Net Wins")
+    ax.set_xlabel("Map")
+
+
+def _setup_map_play_count(ax: Axes):
+    ax.set_ylabel("Play Count")
+    ax.set_xlabel("Map")
+
+
+def map_winrate(map_names: list[str], values: np.ndarray, hue: list[str], palette: dict[str, str],
+                count_only: bool = False, win_loss: bool = False) -> Figure:
+    """per-map winrate plot"""
+    logging.info("making plot")
+    if count_only:
+        if win_loss:
+            template = get_template("map_net_wins", setup=_setup_map_net_wins)
+        else:
+            template = get_template("map_play_count", setup=_setup_map_play_count)
+        ax = template.ax
+
+        _bars(ax, map_names, values, hue, palette)
+        if win_loss:
+            y_min, y_max = ax.get_ylim()
+            y_abs = max(abs(y_min), abs(y_max))
+            ax.set_ylim(-y_abs, y_abs)
+    else:
+        template = get_template("map_winrate", setup=_setup_map_winrate)
+        ax = template.ax
+
+        _bars(ax, map_names, 100 * values, hue, palette)
+        ax.set_ylim(0, 100)
+
+    setp(ax.get_xticklabels(), rotation=45, ha="right", va="center", rotation_mode="anchor")
+
+    return template.fig
+
+
+def _bars(ax: Axes, names: list[str], values: np.ndarray, hue: list[str], palette: dict[str, str]):
+    """one bar per name, coloured (and labelled in the legend) by its hue"""
+    positions = np.arange(len(names))
+    hue = np.asarray(hue)
+    for level in dict.fromkeys(hue):
+        matches = hue == level
+        ax.bar(positions[matches], values[matches], 0.8, color=_desaturate(palette[level]), label=level)
+
+    ax.set_xticks(positions, names)
+    ax.set_xlim(-0.5, len(names) - 0.5)
+    ax.legend(loc="best")
+
+
+def _desaturate(color: str, saturation: float = 0.75) -> tuple[float, float, float]:
+    """softens a bar colour, as seaborn does"""
+    hue, lightness, color_saturation = colorsys.rgb_to_hls(*to_rgb(color))
+    return colorsys.hls_to_rgb(hue, lightness, color_saturation * saturation)
+
+
+def _setup_relative_rank(ax: Axes):
+    ax.set_ylabel("Net Wins")
+
+
+def _setup_relative_rank_games(ax: Axes):
+    _setup_relative_rank(ax)
+    ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+    ax.grid(axis="x", color="white", alpha=0.5)
+
+
+def relative_rank(x: np.ndarray, cumulative: np.ndarray, real_dates: bool = False,
+                  season_lines: dict[int, int] | None = None) -> Figure:
+    """cumulative net wins, against either game number or real dates"""
+    logging.info("making plot")
+    width = 18 if cumulative.shape[0] > 50 else 12
+
+    if real_dates:
+        template = get_template("relative_rank_dates", width, setup=_setup_relative_rank)
+        ax = template.ax
+        ax.plot(x, cumulative, drawstyle='steps-mid', linewidth=2)
+        ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(ax.xaxis.get_major_locator()))
+        ax.set_xlabel("time")
+    else:
+        template = get_template("relative_rank_games", width, setup=_setup_relative_rank_games)
+        ax = template.ax
+        ax.plot(x, cumulative, drawstyle='steps-post', linewidth=2)
+        x_min, x_max = ax.get_xlim()
+        ax.set_xlim(x_min, x_max - 0.5)
+
+    if season_lines:
+        _add_season_lines(ax, season_lines, real_dates=real_dates)
+
+    ax.axhline(0, color="white", linewidth=1, zorder=0, linestyle="dashed")
+    ax.axhline(cumulative.min(), color="tab:red", linewidth=1, zorder=0, linestyle="dashed", label="Min")
+    ax.axhline(cumulative.max(), color="tab:green", linewidth=1, zorder=0, linestyle="dashed", label="Max")
+    ax.axhline(cumulative.mean(), color="tab:pink", linewidth=1, zorder=0, linestyle="dashdot",
+               label="Mean")
+    ax.axhline(np.median(cumulative), color="tab:olive", linewidth=1, zorder=0, linestyle="dashdot",
+               label="Median")
+
+    legend = ax.legend()
+
+    # fancy legend
+    legend.get_frame().set_alpha(0.3)
+    legend.get_frame().set_edgecolor("white")
+    legend.get_frame().set_linewidth(1)
+    legend.get_frame().set_boxstyle("round,pad=0.4,rounding_size=0.3")
+
+    return template.fig
+
+
+def _setup_streak(ax: Axes):
+    ax.set_ylabel("Streak")
+
+
+def streak(data_x: np.ndarray, data_y: np.ndarray, game_count: int, keep_aspect: bool = True,
+           season_lines: dict[int, int] | None = None) -> Figure:
+    """win / loss streaks, drawn as triangles"""
+    logging.info("making plot")
+    template = get_template("streak", 18 if game_count > 50 else 12, setup=_setup_streak)
+    ax = template.ax
+
+    if season_lines:
+        _add_season_lines(ax, season_lines)
+
+    ax.plot(data_x, data_y, color="white")
+    ax.fill_between(data_x, data_y, 0, where=data_y >= 0, color="tab:green", alpha=0.3)
+    ax.fill_between(data_x, data_y, 0, where=data_y <= 0, color="tab:red", alpha=0.3)
+    ax.axhline(0, color="white", linewidth=1.5, zorder=2)
+    ax.axhline(data_y.max(), color="tab:green", linestyle="dashed", linewidth=1, zorder=-1)
+    ax.axhline(data_y.min(), color="tab:red", linestyle="dashed", linewidth=1, zorder=-1)
+
+    # ax.autoscale(enable=True, axis='x', tight=True)
+    ax.set_xlim(-1, game_count + 1)
+    y_min, y_max = ax.get_ylim()
+    y_abs = max(abs(y_min), abs(y_max))
+    ax.set_ylim(-y_abs, y_abs)
+
+    if keep_aspect:
+        ax.axis("equal")
+
+    return template.fig
+
+
+def _add_season_lines(ax: Axes, season_lines: dict[int, int], real_dates: bool = False):
+    """draws a line at the start of each season, given the number of games played before it"""
+    for season, index in season_lines.items():
+        if real_dates:
+            value = mdates.date2num(np.datetime64(SEASONS[season]))
+            ax.axvline(value, color="white", linewidth=1, zorder=0)
+        else:
+            ax.axvline(index + 0.5, color="white", linewidth=1, zorder=0)
+
+
+def export_figure(fig: Figure, dpi: float = 100, max_width: int = 1800, format: str = "png",
+                  compression: int = 6) -> bytes:
+    """encodes a figure, at most `max_width` pixels wide (see `EXPORT_PROFILES`)"""
+    logging.info("making image")
+    # savefig's default dpi is the one the figure was created with, not `fig.set_dpi`
+    width, _ = fig.get_size_inches()
+    dpi = min(dpi, max_width / width)
+    # laid out at the dpi plots always have been, as text extents (and so the layout) shift
+    # slightly with dpi. this keeps the images the same as before export profiles
+    fig.set_dpi(LAYOUT_DPI)
+    fig.tight_layout()
+
+    if format == "webp":
+        pil_kwargs = {"quality": compression, "method": 2}  # past 2, much slower for little gain
+    else:
+        pil_kwargs = {"compress_level": compression}
+
+    buffer = BytesIO()
+    fig.savefig(buffer, dpi=dpi, transparent=True, format=format, pil_kwargs=pil_kwargs)
+    return buffer.getvalue()
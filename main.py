@@ -3,6 +3,10 @@
 import os
 import logging
 import argparse
+import time
+
+# before anything slow is imported, for the startup report
+STARTED_AT = time.perf_counter()
 
 from dotenv import load_dotenv
 
@@ -11,6 +15,9 @@ from commands import BaseCommands
 from plotting import PlotCommands
 from rank_update import UpdateCommand
 from db_handler import DatabaseHandler
+from metrics import metrics
+
+IMPORT_TIME = time.perf_counter() - STARTED_AT
 
 if __name__ == "__main__":
 
@@ -25,13 +32,20 @@ if __name__ == "__main__":
     else:
         logging.basicConfig(level=logging.INFO)
 
-    if args.debug:
-        db_handler = DatabaseHandler(root_dir="../maprater-data/")
-    else:
-        db_handler = DatabaseHandler(root_dir="/data/")
+    metrics.observe("startup", "imports", IMPORT_TIME)
+    logging.info("Imported in %.2fs", IMPORT_TIME)
 
     # Load a discord API key from a .env file
     load_dotenv()
+
+    # optionally commit votes in batches, waiting up to this long for others
+    WRITE_BATCH_MS = os.getenv("WRITE_BATCH_MS", None)
+    batch_delay = int(WRITE_BATCH_MS) / 1000 if WRITE_BATCH_MS else None
+
+    if args.debug:
+        db_handler = DatabaseHandler(root_dir="../maprater-data/", batch_delay=batch_delay)
+    else:
+        db_handler = DatabaseHandler(root_dir="/data/", batch_delay=batch_delay)
     if args.debug:
         logging.info("Using debug variables")
         TOKEN = os.getenv("DISCORD_TOKEN_TEST")
@@ -41,11 +55,16 @@ if __name__ == "__main__":
         TOKEN = os.getenv("DISCORD_TOKEN")
         GUILD = os.getenv("DISCORD_GUILD", None)
 
+    # optionally serve metrics for Prometheus to scrape
+    METRICS_PORT = os.getenv("METRICS_PORT", None)
+    metrics_port = int(METRICS_PORT) if METRICS_PORT else None
+
     if args.all_servers:
-        bot = MapRater(db_handler=db_handler, debug_guilds=[GUILD])
+        bot = MapRater(db_handler=db_handler, debug_guilds=[GUILD], metrics_port=metrics_port,
+                       started_at=STARTED_AT)
 
     else:
-        bot = MapRater(db_handler=db_handler)
+        bot = MapRater(db_handler=db_handler, metrics_port=metrics_port, started_at=STARTED_AT)
 
     if args.debug:
         @bot.slash_command()
@@ -53,6 +72,15 @@ if __name__ == "__main__":
             """Show bot latency [debug]"""
             await ctx.respond(f"pong! [{round(bot.latency, 2)}s]", ephemeral=True)
 
+    @bot.slash_command()
+    async def stats(ctx):
+        """Show command timings and the slowest servers [admin]"""
+        if not await bot.is_owner(ctx.author):
+            await ctx.respond(":warning: Only the bot's owner can see this", ephemeral=True)
+            return
+
+        await ctx.respond(f"```\n{metrics.summary()[:1900]}\n```", ephemeral=True)
+
     bot.add_cog(BaseCommands(bot.db_handler))
     bot.add_cog(PlotCommands(bot.db_handler))
     bot.add_cog(UpdateCommand(bot.db_handler))
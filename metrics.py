@@ -0,0 +1,184 @@
+"""
+In-process timing histograms for the hot paths.
+Commands are timed as a whole with `timed` (or `command`), and the stages
+within them (database fetch, data prep, render, encode, upload) with `span`,
+which records against whichever command is running.
+Optionally served in the Prometheus text format by `start_server`.
+"""
+
+import contextvars
+import functools
+import logging
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds, in seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# upper bounds, in bytes
+SIZE_BUCKETS = (2**14, 2**15, 2**16, 2**17, 2**18, 2**19, 2**20, 2**21, 2**22, 2**23)
+
+
+class Histogram:
+    """Counts observations by bucket, as per Prometheus"""
+    def __init__(self, buckets: tuple = TIME_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last is for everything above the buckets
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """estimates a quantile as the upper bound of the bucket it falls in"""
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf, ), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def to_prometheus(self, name: str, labels: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf, ), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == math.inf else f"{bound:g}"
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:g}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class Metrics:
+    """All of the bot's histograms"""
+    def __init__(self) -> None:
+        # (command, span) -> time taken
+        self.spans: dict[tuple[str, str], Histogram] = {}
+        # guild id -> total time taken by its commands
+        self.guilds: dict[int, Histogram] = {}
+        # export quality -> encoded image size
+        self.image_sizes: dict[str, Histogram] = {}
+
+    def observe(self, command: str, span: str, seconds: float):
+        self.spans.setdefault((command, span), Histogram()).observe(seconds)
+
+    def observe_guild(self, guild_id: int, seconds: float):
+        self.guilds.setdefault(guild_id, Histogram()).observe(seconds)
+
+    def observe_image(self, quality: str, size: int):
+        self.image_sizes.setdefault(quality, Histogram(SIZE_BUCKETS)).observe(size)
+
+    def to_prometheus(self) -> str:
+        """all histograms, in the Prometheus text format"""
+        lines = ["# HELP maprater_span_seconds Time taken by each stage of a command",
+                 "# TYPE maprater_span_seconds histogram"]
+        for (command, span), histogram in sorted(self.spans.items()):
+            lines += histogram.to_prometheus("maprater_span_seconds", f'command="{command}",span="{span}"')
+
+        lines += ["# HELP maprater_guild_seconds Time taken by each guild's commands",
+                  "# TYPE maprater_guild_seconds histogram"]
+        for guild_id, histogram in sorted(self.guilds.items()):
+            lines += histogram.to_prometheus("maprater_guild_seconds", f'guild="{guild_id}"')
+
+        lines += ["# HELP maprater_image_bytes Encoded size of each plot",
+                  "# TYPE maprater_image_bytes histogram"]
+        for quality, histogram in sorted(self.image_sizes.items()):
+            lines += histogram.to_prometheus("maprater_image_bytes", f'quality="{quality}"')
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self, slowest_guilds: int = 5) -> str:
+        """a human-readable summary of the command timings, and the slowest guilds"""
+        lines = [f"{'command':<16}{'span':<8}{'n':>6}{'mean':>9}{'p50':>10}{'p90':>10}{'p99':>10}"]
+        for (command, span), histogram in sorted(self.spans.items()):
+            lines.append(f"{command[:15]:<16}{span:<8}{histogram.count:>6}"
+                         f"{histogram.sum / histogram.count:>8.3f}s"
+                         + "".join(f"{_format_bound(histogram.quantile(q)):>10}" for q in (0.5, 0.9, 0.99)))
+
+        guilds = sorted(self.guilds.items(), key=lambda item: item[1].sum / item[1].count, reverse=True)
+        if guilds:
+            lines += ["", f"{'slowest guilds':<24}{'n':>6}{'mean':>9}{'p90':>10}"]
+            for guild_id, histogram in guilds[:slowest_guilds]:
+                lines.append(f"{guild_id:<24}{histogram.count:>6}{histogram.sum / histogram.count:>8.3f}s"
+                             f"{_format_bound(histogram.quantile(0.9)):>10}")
+
+        return "\n".join(lines)
+
+
+def _format_bound(bound: float) -> str:
+    return "inf" if bound == math.inf else f"≤{bound:g}s"
+
+
+metrics = Metrics()
+# the (name, guild id) of the command being run, if any
+_current_command: contextvars.ContextVar[tuple[str, int | None] | None] = contextvars.ContextVar(
+    "current_command", default=None
+)
+
+
+def record(span: str, seconds: float):
+    """records the time taken by a stage of the running command"""
+    current = _current_command.get()
+    metrics.observe(current[0] if current is not None else "other", span, seconds)
+
+
+@contextmanager
+def span(name: str):
+    """times a stage of the running command"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+@contextmanager
+def command(name: str, guild_id: int | None = None):
+    """times a command in total, labelling any spans within it"""
+    token = _current_command.set((name, guild_id))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe(name, "total", seconds)
+        if guild_id is not None:
+            metrics.observe_guild(guild_id, seconds)
+        _current_command.reset(token)
+
+
+def timed(name: str):
+    """
+    decorates a command's callback to time it (see `command`).
+    the signature is kept (via `functools.wraps`), so slash command options still work
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, ctx, *args, **kwargs):
+            with command(name, ctx.guild_id):
+                return await func(self, ctx, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+async def start_server(port: int, host: str = "0.0.0.0"):
+    """serves the metrics at `/metrics`, returning the runner to clean up"""
+    from aiohttp import web
+
+    async def handle(_):
+        return web.Response(body=metrics.to_prometheus().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Serving metrics on port %s", port)
+    return runner
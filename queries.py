@@ -1,3 +1,5 @@
+from constants import MAP_TYPE_BY_NAME
+
 CREATE_USER_TABLE = """
 CREATE TABLE IF NOT EXISTS users (
     user_id   INTEGER PRIMARY KEY NOT NULL,
@@ -33,6 +35,85 @@ CREATE TABLE IF NOT EXISTS ow2 (
 )
 """
 
+# applied to every connection. WAL lets plot reads run alongside vote writes,
+# and with WAL, NORMAL sync only fsyncs on checkpoint rather than every commit
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -8192",  # KiB, i.e. 8MiB
+    "PRAGMA mmap_size = 67108864",  # 64MiB
+    "PRAGMA wal_autocheckpoint = 1000",  # pages
+]
+# run before a pooled connection is closed, so the WAL file does not linger
+WAL_CHECKPOINT = "PRAGMA wal_checkpoint(TRUNCATE)"
+
+# wins / losses / draws per user and map, kept up to date as ratings are
+# added and deleted. wide wins and losses count as wins and losses
+CREATE_MAP_STATS_TABLE = """
+CREATE TABLE IF NOT EXISTS map_stats (
+    author_id   INTEGER NOT NULL,
+    map_id      INTEGER NOT NULL,
+    wins        INTEGER NOT NULL,
+    losses      INTEGER NOT NULL,
+    draws       INTEGER NOT NULL,
+    last_played INTEGER NOT NULL,
+    PRIMARY KEY (author_id, map_id)
+)
+"""
+REBUILD_MAP_STATS = [
+    "DELETE FROM map_stats",
+    """
+    INSERT INTO map_stats (author_id, map_id, wins, losses, draws, last_played)
+        SELECT author_id, map_id,
+               SUM(result IN ('win', 'wide-win')), SUM(result IN ('loss', 'wide-loss')), SUM(result = 'draw'),
+               MAX(datetime)
+            FROM ow2
+            GROUP BY author_id, map_id
+    """,
+]
+
+# schema changes for existing databases, applied in order on first use.
+# the number applied so far is tracked with `PRAGMA user_version`. each step
+# is a statement, or a (statement, parameters) pair to run with executemany
+MIGRATIONS = [
+    # 1: indexes for the per-user, per-map and per-season lookups
+    [
+        "CREATE INDEX IF NOT EXISTS ow2_author_map ON ow2 (author_id, map_id, rating_id)",
+        "CREATE INDEX IF NOT EXISTS ow2_author ON ow2 (author_id, rating_id)",
+        "CREATE INDEX IF NOT EXISTS ow2_datetime ON ow2 (datetime)",
+    ],
+    # 2: store the type of each map, so it can be filtered on
+    [
+        "ALTER TABLE maps ADD COLUMN map_type TEXT",
+        ("UPDATE maps SET map_type = ? WHERE map_name = ?",
+         [(map_type.name.title(), map_name) for map_name, map_type in MAP_TYPE_BY_NAME.items()]),
+    ],
+    # 3: index for time-bounded per-user lookups (e.g. /today)
+    [
+        "CREATE INDEX IF NOT EXISTS ow2_author_datetime ON ow2 (author_id, datetime)",
+    ],
+    # 4: per-server settings (e.g. plot quality)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            key   TEXT PRIMARY KEY NOT NULL,
+            value TEXT NOT NULL
+        )
+        """,
+    ],
+    # 5: per-user, per-map aggregates
+    [
+        CREATE_MAP_STATS_TABLE,
+        *REBUILD_MAP_STATS,
+    ],
+]
+
+def SET_SCHEMA_VERSION(version: int):
+    """Method to record the number of migrations applied"""
+    return f"PRAGMA user_version = {int(version):0d}"
+
+SELECT_SCHEMA_VERSION = "PRAGMA user_version"
+
 # CREATE_UPDATE_TABLE = """
 # CREATE TABLE IF NOT EXISTS rank_updates (
 #     user_id INTEGER NOT NULL,
@@ -43,19 +124,37 @@ CREATE TABLE IF NOT EXISTS ow2 (
 # """
 
 SELECT_COUNT = "SELECT COUNT(rating_id) FROM ow2"
-SELECT_ALL_PANDAS = """
-SELECT users.username as author, maps.map_name as map, ow2.result as winloss, datetime(ow2.datetime, 'unixepoch') as time
-    FROM ow2
-        INNER JOIN users ON ow2.author_id = users.user_id
-        INNER JOIN maps ON ow2.map_id = maps.map_id 
-"""
-SELECT_ALL_PANDAS_SEASON = """
-SELECT users.username as author, maps.map_name as map, ow2.result as winloss, datetime(ow2.datetime, 'unixepoch') as time
+SELECT_MAX_RATING_ID = "SELECT MAX(rating_id) FROM ow2"
+def SELECT_PANDAS_SINCE(username: bool = False, map_name: bool = False, map_type: bool = False):
+    """
+    Method to select entries after a given rating id, optionally filtering
+    by username, map name and / or map type
+    """
+    conditions = ["ow2.rating_id > ?"]
+    if username:
+        conditions.append("users.username = ?")
+    if map_name:
+        conditions.append("maps.map_name = ?")
+    if map_type:
+        conditions.append("maps.map_type = ?")
+
+    return f"""
+        SELECT ow2.rating_id, users.username as author, maps.map_name as map, ow2.result as winloss, ow2.datetime as time
+            FROM ow2
+                INNER JOIN users ON ow2.author_id = users.user_id
+                INNER JOIN maps ON ow2.map_id = maps.map_id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY ow2.rating_id
+    """
+# one page of the data export, after a given rating id
+SELECT_EXPORT_PAGE = """
+SELECT ow2.rating_id, users.username, maps.map_name, ow2.result, datetime(ow2.datetime, 'unixepoch')
     FROM ow2
         INNER JOIN users ON ow2.author_id = users.user_id
         INNER JOIN maps ON ow2.map_id = maps.map_id
-    WHERE ow2.datetime >= unixepoch(?)
-      AND ow2.datetime < unixepoch(?)
+    WHERE ow2.rating_id > ?
+    ORDER BY ow2.rating_id
+    LIMIT ?
 """
 def SELECT_LAST_N(n: int):
     """Method to select `n` entries from the dataset"""
@@ -67,14 +166,17 @@ def SELECT_LAST_N(n: int):
             ORDER BY rating_id DESC
             LIMIT {min(100, max(1, int(n))):0d}
     """
-def SELECT_LAST_N_USERNAME(n: int):
-    """Method to select `n` entries from the dataset, filtering by username"""
+def SELECT_LAST_N_USERNAME(n: int, up_to: bool = False):
+    """
+    Method to select `n` entries from the dataset, filtering by username,
+    and optionally to ratings up to a given id
+    """
     return f"""
         SELECT ow2.rating_id, users.username, maps.map_name, ow2.result, ow2.datetime
             FROM ow2
                 INNER JOIN users ON ow2.author_id = users.user_id
                 INNER JOIN maps ON ow2.map_id = maps.map_id
-            WHERE users.username = ?
+            WHERE users.username = ? {"AND ow2.rating_id <= ?" if up_to else ""}
             ORDER BY rating_id DESC
             LIMIT {min(100, max(1, int(n))):0d}
     """
@@ -91,15 +193,95 @@ def SELECT_LAST_N_USERNAME_MAP(n: int):
             LIMIT {min(100, max(1, int(n))):0d}
     """
 
-SELECT_USERID_FROM_USERNAME = "SELECT user_id FROM users WHERE username = ?"
-SELECT_MAPID_FROM_MAPNAME = "SELECT map_id FROM maps WHERE map_name = ?"
+def SELECT_LAST_N_TYPE(n: int):
+    """Method to select `n` entries from the dataset, filtering by map type"""
+    return f"""
+        SELECT ow2.rating_id, users.username, maps.map_name, ow2.result, ow2.datetime
+            FROM ow2
+                INNER JOIN users ON ow2.author_id = users.user_id
+                INNER JOIN maps ON ow2.map_id = maps.map_id
+            WHERE maps.map_type = ?
+            ORDER BY rating_id DESC
+            LIMIT {min(100, max(1, int(n))):0d}
+    """
+def SELECT_LAST_N_USERNAME_TYPE(n: int):
+    """Method to select `n` entries from the dataset, filtering by username and map type"""
+    return f"""
+        SELECT ow2.rating_id, users.username, maps.map_name, ow2.result, ow2.datetime
+            FROM ow2
+                INNER JOIN users ON ow2.author_id = users.user_id
+                INNER JOIN maps ON ow2.map_id = maps.map_id
+            WHERE users.username = ?
+            AND maps.map_type = ?
+            ORDER BY rating_id DESC
+            LIMIT {min(100, max(1, int(n))):0d}
+    """
+def SELECT_SINCE_USERNAME(n: int):
+    """Method to select up to `n` entries since a given time, filtering by username"""
+    return f"""
+        SELECT ow2.rating_id, users.username, maps.map_name, ow2.result, ow2.datetime
+            FROM ow2
+                INNER JOIN users ON ow2.author_id = users.user_id
+                INNER JOIN maps ON ow2.map_id = maps.map_id
+            WHERE users.username = ?
+            AND ow2.datetime >= ?
+            ORDER BY rating_id DESC
+            LIMIT {min(100, max(1, int(n))):0d}
+    """
+SELECT_RESULT_COUNTS_SINCE_USERNAME = """
+SELECT ow2.result, COUNT(*)
+    FROM ow2
+        INNER JOIN users ON ow2.author_id = users.user_id
+    WHERE users.username = ?
+    AND ow2.datetime >= ?
+    GROUP BY ow2.result
+"""
+
+def SELECT_MAP_STATS(username: bool = False):
+    """Method to select the wins, losses and draws on each map, optionally filtering by username"""
+    return f"""
+        SELECT maps.map_name, SUM(map_stats.wins), SUM(map_stats.losses), SUM(map_stats.draws)
+            FROM map_stats
+                INNER JOIN maps ON map_stats.map_id = maps.map_id
+                {"INNER JOIN users ON map_stats.author_id = users.user_id WHERE users.username = ?" if username else ""}
+            GROUP BY maps.map_name
+            ORDER BY maps.map_name
+    """
+UPSERT_MAP_STATS = """
+INSERT INTO map_stats (author_id, map_id, wins, losses, draws, last_played) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (author_id, map_id) DO UPDATE SET
+        wins = wins + excluded.wins,
+        losses = losses + excluded.losses,
+        draws = draws + excluded.draws,
+        last_played = MAX(last_played, excluded.last_played)
+"""
+# run after the ratings are deleted, so the last played time can be found again
+UPDATE_MAP_STATS_DELETED = """
+UPDATE map_stats SET
+    wins = wins - ?,
+    losses = losses - ?,
+    draws = draws - ?,
+    last_played = COALESCE(
+        (SELECT MAX(datetime) FROM ow2 WHERE ow2.author_id = map_stats.author_id AND ow2.map_id = map_stats.map_id),
+        last_played
+    )
+    WHERE author_id = ? AND map_id = ?
+"""
+DELETE_EMPTY_MAP_STATS = "DELETE FROM map_stats WHERE wins + losses + draws <= 0"
+
+SELECT_SETTINGS = "SELECT key, value FROM settings"
+UPSERT_SETTING = """
+INSERT INTO settings (key, value) VALUES (?, ?)
+    ON CONFLICT (key) DO UPDATE SET value = excluded.value
+"""
 
 def DELETE_N_IDS(n: int):
-    """Method to delete `n` ids from the dataset"""
+    """Method to delete `n` ids from the dataset, returning the deleted ratings"""
     return f"""
         DELETE FROM ow2
             WHERE rating_id IN
                 ({', '.join(['?']*n)})
+            RETURNING author_id, map_id, result
     """
 
 INSERT_INTO_DATA = """
@@ -107,8 +289,18 @@ INSERT INTO ow2
     (author_id, map_id, result, datetime)
     VALUES (?, ?, ?, ?)
 """
-INSERT_INTO_USERS = "INSERT INTO users (username) values (?)"
-INSERT_INTO_MAPS = "INSERT INTO maps (map_name) values (?)"
+# the no-op update means an existing row is still returned, so concurrent
+# inserts of the same name both get the same id back
+UPSERT_USER = """
+INSERT INTO users (username) VALUES (?)
+    ON CONFLICT (username) DO UPDATE SET username = excluded.username
+    RETURNING user_id
+"""
+UPSERT_MAP = """
+INSERT INTO maps (map_name, map_type) VALUES (?, ?)
+    ON CONFLICT (map_name) DO UPDATE SET map_type = coalesce(maps.map_type, excluded.map_type)
+    RETURNING map_id
+"""
 # INSERT_RANK_UPDATES = """
 # INSERT INTO rank_updates
 #     (user_id, role, rating_id)
@@ -0,0 +1,151 @@
+"""
+Renders plots in a pool of worker processes, so that drawing and encoding
+figures does not block the event loop.
+Processes are used rather than threads as pyplot's state is global.
+"""
+
+import asyncio
+import functools
+import logging
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Hashable
+
+from constants import DEFAULT_EXPORT_QUALITY, EXPORT_PROFILES, ExportQuality, TTL
+from metrics import metrics, record
+
+
+class RenderQueueFull(Exception):
+    """Raised when too many plots are already waiting to be rendered"""
+
+
+def _render(figure: str, profile: dict, *args, **kwargs) -> tuple[bytes, float, float]:
+    """
+    runs in a worker: draws the named figure from `figures`, then encodes it as per `profile`.
+    returns the image, and the time taken to draw and to encode it
+    """
+    # imported here so that only the workers pay for importing matplotlib
+    import figures
+    start = time.perf_counter()
+    fig = getattr(figures, figure)(*args, **kwargs)
+    drawn = time.perf_counter()
+    image = figures.export_figure(fig, **profile)
+    return image, drawn - start, time.perf_counter() - drawn
+
+
+def _warm_up():
+    """runs in a worker: imports matplotlib ahead of the first plot"""
+    import figures  # noqa: F401
+
+
+class RenderPool:
+    """A pool of plot-rendering processes, with a bounded queue"""
+    def __init__(self, workers: int = 2, max_pending: int = 8) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            logging.info("Starting %s render worker(s)", self.workers)
+            # don't fork: the bot has running threads (e.g. database connections)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    async def warm_up(self):
+        """starts the workers, so the first plot does not wait for them (or for matplotlib)"""
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(*[loop.run_in_executor(executor, _warm_up) for _ in range(self.workers)])
+
+    async def render(self, figure: str, *args, quality: ExportQuality = DEFAULT_EXPORT_QUALITY, **kwargs) -> bytes:
+        """
+        renders a figure from `figures` as image bytes, encoded as per the quality's export profile
+        raises `RenderQueueFull` if too many plots are already queued
+        """
+        if self.pending >= self.max_pending:
+            raise RenderQueueFull()
+
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            start = time.perf_counter()
+            image, draw_time, encode_time = await loop.run_in_executor(
+                self._get_executor(),
+                functools.partial(_render, figure, EXPORT_PROFILES[quality], *args, **kwargs)
+            )
+            # anything else is time spent waiting for a worker, or sending data to / from it
+            record("queue", time.perf_counter() - start - draw_time - encode_time)
+            record("render", draw_time)
+            record("encode", encode_time)
+
+            logging.info("Rendered %s (%s): %s bytes", figure, quality.value, len(image))
+            metrics.observe_image(quality.value, len(image))
+            return image
+        except BrokenProcessPool:
+            # a worker died - start a fresh pool for the next request
+            logging.exception("Render pool broken, restarting")
+            self.close()
+            raise
+        finally:
+            self.pending -= 1
+
+    def close(self):
+        """stops the worker processes"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class ImageCache:
+    """
+    Caches rendered plots (alongside their message) for `ttl` seconds, so
+    that repeated button presses do not re-render identical images.
+    Keys should include the server's data version, so new ratings are seen.
+    """
+    def __init__(self, ttl: float = TTL, max_bytes: int = 64 * 2**20) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[Hashable, tuple[float, str, bytes, str]] = OrderedDict()
+
+    def get(self, key: Hashable) -> tuple[str, bytes, str] | None:
+        """gets the (content, image, filename) for a key, if still fresh"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires, content, image, filename = entry
+        if expires < time.monotonic():
+            self._pop(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return content, image, filename
+
+    def put(self, key: Hashable, content: str, image: bytes, filename: str):
+        """caches a rendered image, evicting the oldest if over budget"""
+        if len(image) > self.max_bytes:
+            return
+
+        self._pop(key)
+        self._entries[key] = (time.monotonic() + self.ttl, content, image, filename)
+        self.size += len(image)
+
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._entries)))
+
+    def _pop(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[2])
+
+
+# shared between the plot commands and the persistent plot buttons
+render_pool = RenderPool()
+image_cache = ImageCache()